@@ -3,10 +3,19 @@
 В итоге вышла какая-то хрень
 """
 
+import gzip
 import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from queue import Queue
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
 
 
 # region Primitives
@@ -162,20 +171,269 @@ class Physics:
 
         return points[:length or 999]  # не самый лучший вариант, зато в коде места не занимает
 
+
+# endregion
+
+
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
+
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
     @staticmethod
-    def circle_points(center: Vector, amount: int, angle: int, player_id: int):
-        """Метод для нахождения координат построения"""
-        circle_shifts = [Vector(-1, 5, 1), Vector(0, 5, 0), Vector(1, 5, -1),
-                         Vector(2, 4, -2), Vector(3, 3, -2), Vector(4, 2, -2),
-                         Vector(5, 1, -1), Vector(5, 0, 0), Vector(5, -1, 1),
-                         Vector(4, -2, 2), Vector(3, -2, 3), Vector(2, -2, 4),
-                         Vector(1, -1, 5), Vector(0, 0, 5), Vector(-1, 1, 5),
-                         Vector(-2, 4, 2), Vector(-2, 3, 3), Vector(-2, 2, 4)]
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
+        else:
+            with open(self.target, 'a') as file:
+                file.write(self.report())
 
-        k = len(circle_shifts)
 
-        for i in range(angle, k + angle, k // amount):
-            yield center + circle_shifts[i % k] * player_id
+PROFILER = Profiler(os.environ.get('PROFILE'))
+
+
+# endregion
+
+
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
 
 
 # endregion
@@ -469,17 +727,161 @@ class UserOutput(JSONCapability):
 # endregion
 
 
+# region Formations
+
+
+def min_cost_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Венгерский алгоритм для матрицы стоимостей (n, m), n <= m: для каждой строки - свой столбец
+    с наименьшей суммой стоимостей. Внутренний цикл по столбцам векторизован, всего O(n^2 m)
+    """
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    # owner[j] - строка (с единицы), занявшая столбец j; нулевой столбец - фиктивный
+    owner = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[column]:
+            used[column] = True
+            free = ~used
+            free[0] = False
+            reduced = cost[owner[column] - 1] - u[owner[column]] - v[1:]
+            better = free[1:] & (reduced < slack[1:])
+            slack[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, slack, np.inf)
+            following = int(candidates.argmin())
+            delta = candidates[following]
+            u[owner[used]] += delta
+            v[used] -= delta
+            slack[free] -= delta
+            column = following
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    result = np.empty(n, dtype=np.int64)
+    taken = np.nonzero(owner[1:])[0]
+    result[owner[1:][taken] - 1] = taken
+    return result
+
+
+class Formation:
+    """
+    Построения для любого числа кораблей и радиуса: кольцо (ring) и линия (line) в плоскости,
+    перпендикулярной оси `axis`, клин (wedge) остриём вдоль оси и сферическая оболочка (shell).
+    Если кораблей больше, чем помещается при заданном радиусе, построение растягивается.
+    Смещения слотов от центра строятся один раз на (форма, число кораблей, радиус, ось, поворот) и хранятся
+    в общем кэше; поворот - `step` из `steps` шагов на оборот вокруг оси.
+    Корабли назначаются на слоты по наименьшему суммарному пути (по Чебышёву, при равенстве - по евклиду),
+    и назначение пересчитывается только при смене состава флота, центра или формы, а не на каждом ходу
+    """
+    SHAPES = ('ring', 'shell', 'wedge', 'line')
+    SPACING = 2
+    slots_cache = {}
+
+    def __init__(self, shape: str = 'ring', radius: int = 4, axis=(1, 1, 1), steps: int = 18):
+        if shape not in self.SHAPES:
+            raise ValueError(f'unknown formation: {shape}')
+        self.shape = shape
+        self.radius = radius
+        self.axis = tuple(axis)
+        self.steps = steps
+        self.key = None
+        self.slot_of = {}
+
+    @staticmethod
+    def basis(axis) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Единичная ось и два перпендикулярных ей единичных вектора"""
+        a = np.asarray(axis, dtype=float)
+        a = a / np.linalg.norm(a)
+        helper = np.eye(3)[int(np.abs(a).argmin())]
+        u = np.cross(a, helper)
+        u /= np.linalg.norm(u)
+        return a, u, np.cross(a, u)
+
+    @classmethod
+    def slots(cls, shape: str, amount: int, radius: int, axis=(1, 1, 1), step: int = 0, steps: int = 18) -> np.ndarray:
+        """Смещения слотов (amount, 3) от центра построения"""
+        key = (shape, amount, radius, tuple(axis), step % steps, steps)
+        offsets = cls.slots_cache.get(key)
+        if offsets is not None:
+            return offsets
+
+        a, u, v = cls.basis(axis)
+        turn = 2 * np.pi * (step % steps) / steps
+        u, v = np.cos(turn) * u + np.sin(turn) * v, -np.sin(turn) * u + np.cos(turn) * v
+        index = np.arange(amount)
+        # если кораблей много, построение растягивается, чтобы между соседними слотами оставалось около SPACING клеток
+        if shape == 'ring':
+            radius = max(radius, cls.SPACING * amount / (2 * np.pi))
+            angle = 2 * np.pi * index / max(amount, 1)
+            points = radius * (np.cos(angle)[:, None] * u + np.sin(angle)[:, None] * v)
+        elif shape == 'shell':
+            # точки Фибоначчи на сфере: почти равномерно при любом числе
+            radius = max(radius, cls.SPACING * np.sqrt(amount / (4 * np.pi)))
+            height = 1 - 2 * (index + 0.5) / max(amount, 1)
+            angle = np.pi * (3 - np.sqrt(5)) * index
+            ring = np.sqrt(1 - height * height)
+            points = radius * (height[:, None] * a + ring[:, None] * (np.cos(angle)[:, None] * u +
+                                                                      np.sin(angle)[:, None] * v))
+        elif shape == 'wedge':
+            # остриё в центре, дальше пары кораблей по обе стороны, отступая назад вдоль оси; radius - длина крыла
+            rank = (index + 1) // 2
+            side = np.where(index % 2, 1, -1) * (index > 0)
+            spacing = max(radius / max(amount // 2, 1), cls.SPACING)
+            points = spacing * rank[:, None] * (side[:, None] * u - a) / np.sqrt(2)
+        else:
+            spacing = max(2 * radius / max(amount - 1, 1), cls.SPACING)
+            points = (index - (amount - 1) / 2)[:, None] * spacing * u
+
+        offsets = np.rint(points).astype(np.int64).reshape(-1, 3)
+        cls.slots_cache[key] = offsets
+        return offsets
+
+    def targets(self, ships: List[Ship], center: Vector, step: int = 0, map_size: int = None) -> Dict[int, Vector]:
+        """Клетка построения для каждого корабля по Id (при `map_size` - в пределах карты)"""
+        center = np.array([center.x, center.y, center.z], dtype=np.int64)
+        key = (tuple(ship.Id for ship in ships), tuple(center.tolist()), self.shape, self.radius, self.axis)
+        slots = self.slots(self.shape, len(ships), self.radius, self.axis, step, self.steps) + center
+        if key != self.key:
+            positions = np.array([(ship.Position.x, ship.Position.y, ship.Position.z) for ship in ships],
+                                 dtype=np.int64).reshape(-1, 3)
+            delta = positions[:, None, :] - slots[None, :, :]
+            chebyshev, squared = np.abs(delta).max(axis=2), (delta * delta).sum(axis=2)
+            # вес больше любой разности суммарных квадратов двух назначений, так что сумма по Чебышёву главнее
+            cost = chebyshev * (squared.max(initial=0) * len(ships) + 1) + squared
+            assigned = min_cost_assignment(cost)
+            self.slot_of = {ship.Id: int(slot) for ship, slot in zip(ships, assigned)}
+            self.key = key
+
+        if map_size is not None:
+            slots = np.clip(slots, 0, map_size - 1)
+        return {ship_id: Vector(*slots[slot].tolist()) for ship_id, slot in self.slot_of.items()}
+
+
+# endregion
+
+
 class Game:
     def __init__(self):
         self.draft_options = None
         self.setup = 7
         self.angle = 1
+        self.formation = None
 
     def draft(self, data: dict) -> DraftChoice:
         self.draft_options = DraftOptions.from_json(data)
         draft_choice = DraftChoice()
 
         self.draft_options.PlayerId = -(self.draft_options.PlayerId or -1)  # 1 низ, -1 вверх
+        # кольцо в плоскости, перпендикулярной диагонали, с поворотом на шаг каждый ход
+        self.formation = Formation('ring', radius=4, axis=(self.draft_options.PlayerId,) * 3, steps=18)
 
         draft_choice.Message = f'money: {self.draft_options.Money} | available ships: ' \
                                f'{", ".join(f"{ship.Id}-{ship.Price}" for ship in self.draft_options.CompleteShips)} ' \
@@ -509,6 +911,7 @@ class Game:
 
     def battle(self, data: dict) -> UserOutput:
         state = State.from_json(data)
+        PROFILER.lap('state')
         user_output = UserOutput()
         user_output.UserCommands = []
 
@@ -536,12 +939,12 @@ class Game:
         elif self.setup > 0:
             center = Vector(3, 3, 3) if self.draft_options.PlayerId > 0 else Vector(26, 26, 26)
 
-            for ship, ship_coord in zip(state.My, Physics.circle_points(center,
-                                                                        len(state.My), 0,
-                                                                        self.draft_options.PlayerId)):
+            slots = self.formation.targets(state.My, center + Vector(2, 2, 2) * self.draft_options.PlayerId,
+                                           step=0, map_size=self.draft_options.MapSize)
+            for ship in state.My:
                 user_output.UserCommands.append(Command(Command=MOVE,
                                                         Parameters=MoveParameters(Id=ship.Id,
-                                                                                  Target=ship_coord)))
+                                                                                  Target=slots[ship.Id])))
                 closest_enemy = min(state.Opponent,
                                     key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
                 if not any([block.Name == 'big_heal' for block in ship.Equipment]):
@@ -558,12 +961,12 @@ class Game:
         else:
             center = Vector(15, 15, 15)
 
-            for ship, ship_coord in zip(state.My, Physics.circle_points(center,
-                                                                        len(state.My), self.angle,
-                                                                        self.draft_options.PlayerId)):
+            slots = self.formation.targets(state.My, center + Vector(2, 2, 2) * self.draft_options.PlayerId,
+                                           step=self.angle, map_size=self.draft_options.MapSize)
+            for ship in state.My:
                 user_output.UserCommands.append(Command(Command=MOVE,
                                                         Parameters=MoveParameters(Id=ship.Id,
-                                                                                  Target=ship_coord)))
+                                                                                  Target=slots[ship.Id])))
                 closest_enemy = min(state.Opponent,
                                     key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
                 if not any([block.Name == 'big_heal' for block in ship.Equipment]):
@@ -580,21 +983,41 @@ class Game:
 
         return user_output
 
-    def main(self):
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             if 'PlayerId' in data:
                 result = self.draft(data)
+                PROFILER.lap('draft')
             else:
                 result = self.battle(data)
+                PROFILER.lap('battle')
 
             line_out = json.dumps(result,
                                   default=JSONCapability.to_json,
                                   ensure_ascii=False)
-            print(line_out)
+            PROFILER.lap('encode')
+            transport.write(line_out.encode())
+            PROFILER.lap('write')
+
+            if recorder is not None:
+                # стратегия меняет словари ввода на месте, поэтому для записи кадр разбирается заново
+                recorder.record(json.loads(frame), frame, line_out.encode())
+                PROFILER.lap('record')
+
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python algos/<бот>.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -3,10 +3,21 @@
 В итоге вышла какая-то хрень
 """
 
+import gzip
+import hashlib
 import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from functools import lru_cache
+from queue import Queue
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
 
 
 # region Primitives
@@ -99,6 +110,37 @@ class Physics:
 
         return sum(value ** 2 for value in vector_diff.coords) ** 0.5
 
+    @staticmethod
+    def as_points(points) -> np.ndarray:
+        """Массив (N, 3) из массива NumPy или списка векторов"""
+        if isinstance(points, np.ndarray):
+            return points.astype(np.int64, copy=False).reshape(-1, 3)
+        return np.array([point.coords for point in points], dtype=np.int64).reshape(-1, 3)
+
+    @staticmethod
+    def pairwise(a, b, metric: str = 'euclidean') -> np.ndarray:
+        """
+        Матрица расстояний (len(a), len(b)) между двумя наборами точек.
+        Метрики: 'chebyshev' (как clen), 'manhattan' (как mlen), 'euclidean' (как get_len_vector)
+        и 'sqeuclidean' - квадрат евклидова расстояния, для сравнений без извлечения корня
+        """
+        delta = Physics.as_points(a)[:, None, :] - Physics.as_points(b)[None, :, :]
+
+        if metric == 'chebyshev':
+            return np.abs(delta).max(axis=2, initial=0)
+        elif metric == 'manhattan':
+            return np.abs(delta).sum(axis=2)
+        elif metric == 'sqeuclidean':
+            return (delta * delta).sum(axis=2)
+        elif metric == 'euclidean':
+            return np.sqrt((delta * delta).sum(axis=2))
+        raise ValueError(f'unknown metric: {metric}')
+
+    @staticmethod
+    def closest(a, b, metric: str = 'sqeuclidean') -> np.ndarray:
+        """Для каждой точки из `a` индекс ближайшей точки из `b` (при равенстве - первой, как у min)"""
+        return Physics.pairwise(a, b, metric).argmin(axis=1)
+
     @staticmethod
     def bresenham_ray(point1: Vector, point2: Vector, length: int = None) -> List[Vector]:
         """Метод для построение вектора по алгоритмы Брезенхама (https://clck.ru/Vbigh)"""
@@ -162,17 +204,269 @@ class Physics:
 
         return points[:length or 999]  # не самый лучший вариант, зато в коде места не занимает
 
+
+# endregion
+
+
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
+
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
     @staticmethod
-    def circle_points(center: Vector, amount: int, angle: int, player_id: int):
-        """Метод для нахождения координат построения"""
-        circle_shifts = [Vector(-1, 2, 3), Vector(-1, 3, 2), Vector(-1, 4, 1), Vector(0, 4, 0), Vector(1, 4, -1),
-                         Vector(2, 3, -1), Vector(3, 2, -1), Vector(4, 1, -1), Vector(4, 0, 0), Vector(4, -1, 1),
-                         Vector(3, -1, 2), Vector(2, -1, 3), Vector(1, -1, 4), Vector(0, 0, 4), Vector(-1, 1, 4)]
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
+        else:
+            with open(self.target, 'a') as file:
+                file.write(self.report())
+
+
+PROFILER = Profiler(os.environ.get('PROFILE'))
+
+
+# endregion
 
-        k = len(circle_shifts)
 
-        for i in range(angle, k + angle, k // amount):
-            yield center + circle_shifts[i % k] * player_id
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
 
 
 # endregion
@@ -352,6 +646,183 @@ class DraftChoice:
 # endregion
 
 
+# region Draft Planning
+
+
+# типичный урон одного попадания и число ходов, за которые оценивается ремонт, для `combat_value`
+TYPICAL_DAMAGE = 6
+HEAL_TURNS = 10
+
+
+def combat_value(blocks: List[Block]) -> float:
+    """
+    Оценка силы корабля в замкнутой форме: урон за ход, на который хватает восполняемой энергии,
+    умноженный на эффективное здоровье (щит снижает урон каждого попадания на Armor,
+    ремонт на оставшуюся энергию добавляет здоровье) и на подвижность.
+    Блоки различаются по полям, поэтому оценка не зависит от того, какие классы блоков знает стратегия
+    """
+    health = sum(getattr(block, 'MaxHealth', 0) for block in blocks)
+    income = sum(getattr(block, 'IncrementPerTurn', 0) for block in blocks)
+    accelerate = sum(getattr(block, 'MaxAccelerate', 0) for block in blocks)
+    guns = [block for block in blocks if hasattr(block, 'Damage')]
+    shields = [block for block in blocks if hasattr(block, 'Armor')]
+    heals = [block for block in blocks if hasattr(block, 'HealthGain')]
+
+    # энергия в первую очередь идёт на пушки, остаток - на щит, затем на ремонт
+    damage = sum(gun.Damage for gun in guns)
+    price = sum(gun.EnergyPrice for gun in guns)
+    share = min(1.0, income / price) if price else 1.0
+    income -= price * share
+
+    armor = 0
+    for shield in sorted(shields, key=lambda block: -block.Armor):
+        if income >= shield.EnergyPrice:
+            armor, income = shield.Armor, income - shield.EnergyPrice
+            break
+    for heal in heals:
+        if heal.EnergyPrice:
+            health += HEAL_TURNS * heal.HealthGain * min(1.0, income / heal.EnergyPrice)
+            income -= min(income, heal.EnergyPrice)
+
+    effective = health * TYPICAL_DAMAGE / max(TYPICAL_DAMAGE - armor, 1)
+    return damage * share * effective * (1 + 0.1 * accelerate)
+
+
+class StartPlacement:
+    """
+    Стартовые клетки набранных кораблей внутри StartArea. Корабли ставятся по одному, сначала с пушками,
+    затем ремонтные, и для каждого все клетки области оцениваются разом:
+    ближе к центру карты - раньше достанут пушки, ремонтный корабль накрывает больше своих,
+    корабль в радиусе уже поставленного ремонтника, а за соседей ближе SPACING клеток - штраф,
+    чтобы один выстрел по клетке или луч рельсы не задевал несколько кораблей
+    """
+    CENTER_WEIGHT = 1.0
+    HEAL_WEIGHT = 4.0
+    SPACING = 2
+    CROWD_PENALTY = 100.0
+
+    def __init__(self, options: DraftOptions, anchor: Vector = None, cells: np.ndarray = None):
+        """
+        `anchor` - куда стягивается построение вместо центра карты, например точка сбора стратегии;
+        `cells` - клетки-кандидаты (N, 3) вместо всей StartArea, например слоты построения
+        """
+        if cells is None:
+            start, end = options.StartArea.From, options.StartArea.To
+            axes = [np.arange(min(a, b), max(a, b) + 1) for a, b in zip((start.x, start.y, start.z), (end.x, end.y, end.z))]
+            cells = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+        self.cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        anchor = (options.MapSize - 1) / 2 if anchor is None else np.array([anchor.x, anchor.y, anchor.z])
+        self.to_center = np.abs(self.cells - anchor).max(axis=1)
+
+        blocks = {item.Equipment.Name: item.Equipment for item in options.Equipment}
+        self.heal_radius = {ship.Id: max([blocks[name].Radius for name in ship.Equipment
+                                          if hasattr(blocks.get(name), 'HealthGain')], default=0)
+                            for ship in options.CompleteShips}
+
+    def place(self, ship_ids: List[str]) -> List[Vector]:
+        """Клетки для кораблей в порядке `ship_ids`"""
+        radii = np.array([self.heal_radius.get(ship_id, 0) for ship_id in ship_ids], dtype=np.int64)
+        order = sorted(range(len(ship_ids)), key=lambda index: radii[index] > 0)
+
+        placed, positions = [], [None] * len(ship_ids)
+        for index in order:
+            score = -self.CENTER_WEIGHT * self.to_center
+            if placed:
+                distance = np.abs(self.cells[:, None, :] - self.cells[placed][None, :, :]).max(axis=2)
+                score = score - self.CROWD_PENALTY * (distance < self.SPACING).sum(axis=1)
+                if radii[index]:
+                    score = score + self.HEAL_WEIGHT * (distance <= radii[index]).sum(axis=1)
+                healers = radii[[order[i] for i in range(len(placed))]]
+                score = score + self.HEAL_WEIGHT * ((distance <= healers[None, :]) & (healers > 0)).any(axis=1)
+                # в одну клетку двух кораблей не ставим
+                score[placed] = -np.inf
+            best = int(score.argmax())
+            placed.append(best)
+            positions[index] = Vector(*self.cells[best].tolist())
+        return positions
+
+
+class DraftOptimizer:
+    """
+    Набор кораблей из CompleteShips как ограниченный рюкзак: суммарная цена не больше Money,
+    кораблей не больше MaxShipsCount, каждый вид можно брать несколько раз, ценность - `value` от блоков корабля.
+    Доминируемые корабли (не дешевле и не ценнее другого) отбрасываются, остальное решает динамика
+    с запоминанием по (вид, остаток денег, остаток мест). Ответы кэшируются на диске по хэшу условий,
+    потому что каталог от матча к матчу обычно не меняется
+    """
+    CACHE = os.environ.get('DRAFT_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'draft_cache.json'))
+
+    def __init__(self, options: DraftOptions, value: Callable[[List[Block]], float] = combat_value):
+        self.options = options
+        self.value = value
+        blocks = {item.Equipment.Name: item.Equipment for item in options.Equipment}
+        self.values = {ship.Id: value([blocks[name] for name in ship.Equipment if name in blocks])
+                       for ship in options.CompleteShips}
+
+    def key(self) -> str:
+        catalog = [(ship.Id, ship.Price, self.values[ship.Id]) for ship in self.options.CompleteShips]
+        data = json.dumps([self.options.Money, self.options.MaxShipsCount, getattr(self.value, '__name__', ''),
+                           catalog], sort_keys=True)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def candidates(self) -> List[DraftCompleteShip]:
+        """Корабли, которых не доминирует никакой другой; при равенстве остаётся первый по каталогу"""
+        ships = sorted(self.options.CompleteShips, key=lambda ship: (ship.Price, -self.values[ship.Id]))
+        kept, best = [], float('-inf')
+        for ship in ships:
+            if self.values[ship.Id] > best and ship.Price <= self.options.Money:
+                kept.append(ship)
+                best = self.values[ship.Id]
+        return kept
+
+    def solve(self) -> List[str]:
+        """Id кораблей набора, от самых ценных"""
+        ships = self.candidates()
+        prices = [ship.Price for ship in ships]
+        values = [self.values[ship.Id] for ship in ships]
+
+        @lru_cache(maxsize=None)
+        def best(index: int, money: int, slots: int) -> Tuple[float, Tuple[int, ...]]:
+            if index == len(ships) or not slots:
+                return 0.0, ()
+            result = (float('-inf'), ())
+            # бесплатных кораблей можно взять сколько угодно, их ограничивают только места
+            limit = min(slots, money // prices[index]) if prices[index] > 0 else slots
+            for count in range(limit + 1):
+                value, counts = best(index + 1, money - count * prices[index], slots - count)
+                if value + count * values[index] > result[0]:
+                    result = (value + count * values[index], (count, *counts))
+            return result
+
+        _, counts = best(0, self.options.Money, self.options.MaxShipsCount)
+        chosen = [ship.Id for ship, count in zip(ships, counts) for _ in range(count)]
+        return sorted(chosen, key=lambda ship_id: -self.values[ship_id])
+
+    def choose(self) -> List[str]:
+        """`solve` через дисковый кэш; недоступный для записи кэш просто не используется"""
+        key = self.key()
+        try:
+            with open(self.CACHE) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            cache = {}
+        if key in cache:
+            return cache[key]
+
+        cache[key] = self.solve()
+        try:
+            temporary = f'{self.CACHE}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(cache, file)
+            os.replace(temporary, self.CACHE)
+        except OSError:
+            pass
+        return cache[key]
+
+
+# endregion
+
+
 # region Battle Input
 
 
@@ -405,6 +876,61 @@ class State(JSONCapability):
 # endregion
 
 
+# region Fleet Arrays
+
+
+class Trajectories:
+    """
+    Прогноз положений кораблей на 0..horizon ходов вперёд при неизменной скорости, сразу для всех кораблей.
+    Упёршись в стену, корабль по этой оси останавливается, поэтому положение через t ходов -
+    просто `Position + t * Velocity`, обрезанное по границам карты.
+    `spread[t, i]` - на сколько клеток по каждой оси i-й корабль может уйти от прогноза за t ходов,
+    если будет ускоряться: a + 2a + ... + ta при его наибольшем ускорении a
+    """
+
+    def __init__(self, positions, velocities, map_size: int, accelerate, horizon: int = 8):
+        self.base = Physics.as_points(positions)
+        self.velocity = Physics.as_points(velocities)
+        self.high = map_size - 1
+        self.accelerate = np.broadcast_to(np.asarray(accelerate, dtype=np.int64), len(self.base))
+        self.extend(horizon)
+
+    def extend(self, horizon: int) -> None:
+        turns = np.arange(horizon + 1)
+        self.positions = np.clip(self.base[None, :, :] + turns[:, None, None] * self.velocity[None, :, :],
+                                 0, self.high)
+        self.spread = (turns * (turns + 1) // 2)[:, None] * self.accelerate[None, :]
+
+    @classmethod
+    def of(cls, ships: List[Ship], map_size: int, accelerate: int = 0, horizon: int = 8):
+        """
+        Прогноз для списка кораблей; ускорение берётся из их двигателей,
+        а для кораблей со скрытым снаряжением (оппонент) - `accelerate`
+        """
+        accelerations = []
+        for ship in ships:
+            if ship.Equipment is None:
+                accelerations.append(accelerate)
+            else:
+                accelerations.append(sum(block.MaxAccelerate for block in ship.Equipment
+                                         if isinstance(block, EngineBlock)))
+        return cls([ship.Position for ship in ships], [ship.Velocity for ship in ships],
+                   map_size, accelerations, horizon)
+
+    def at(self, turns: int) -> np.ndarray:
+        """Положения (N, 3) через `turns` ходов"""
+        if turns >= len(self.positions):
+            self.extend(max(turns, 2 * (len(self.positions) - 1)))
+        return self.positions[turns]
+
+    def lead(self, index: int, turns: int = 1) -> Vector:
+        """Куда целиться в `index`-й корабль: урон считается по положениям после хода, то есть через один ход"""
+        return Vector(*self.at(turns)[index].tolist())
+
+
+# endregion
+
+
 # region Battle Output
 
 
@@ -466,35 +992,275 @@ class UserOutput(JSONCapability):
 # endregion
 
 
+# region Targeting
+
+
+class WeaponAssignment:
+    """
+    Распределение выстрелов всего флота по целям на ход (weapon-target assignment) вместо выбора цели каждым кораблём.
+    Жадно по предельной выгоде: на каждом шаге берётся пара (пушка, цель) с наибольшим полезным уроном -
+    не больше оставшегося здоровья цели, с надбавкой за добивание, - затем здоровье цели и энергия корабля
+    уменьшаются, а пушка выбывает. Выгоды всех пар пересчитываются одной операцией над матрицей (пушки x цели).
+    Дальность проверяется по метрике Чебышёва от текущего положения корабля, а цель - клетка, где корабль оппонента
+    окажется после хода (урон считается по положениям после перемещения)
+    """
+    KILL_BONUS = 10
+
+    def __init__(self, ships: List[Ship], targets, health, spent: Dict[int, int] = None):
+        """
+        `targets` - клетки (T, 3) для кораблей оппонента, `health` - их здоровье,
+        `spent` - энергия по Id корабля, уже потраченная на другие команды этого хода
+        """
+        spent = spent or {}
+        self.ships = ships
+        self.guns, owners = [], []
+        for index, ship in enumerate(ships):
+            for block in ship.Equipment or ():
+                if isinstance(block, GunBlock):
+                    self.guns.append(block)
+                    owners.append(index)
+
+        self.owner = np.array(owners, dtype=np.int64)
+        self.damage = np.array([gun.Damage for gun in self.guns], dtype=np.int64)
+        self.radius = np.array([gun.Radius for gun in self.guns], dtype=np.int64)
+        self.price = np.array([gun.EnergyPrice for gun in self.guns], dtype=np.int64)
+        self.origin = np.array([(ship.Position.x, ship.Position.y, ship.Position.z) for ship in ships],
+                               dtype=np.int64).reshape(-1, 3)[self.owner]
+        self.energy = np.array([(ship.Energy or 0) - spent.get(ship.Id, 0) for ship in ships], dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64).reshape(-1, 3)
+        self.health = np.asarray(health, dtype=np.int64)
+
+    def gain(self, damage, health):
+        """Полезный урон: сверх оставшегося здоровья не засчитывается, добивание поощряется"""
+        return np.minimum(damage, health) + self.KILL_BONUS * (damage >= health)
+
+    def solve(self) -> List[Tuple[Ship, GunBlock, int]]:
+        """Выстрелы в виде (корабль, пушка, индекс цели); пушки без полезной цели не стреляют"""
+        if not len(self.guns) or not len(self.targets):
+            return []
+        reach = np.abs(self.origin[:, None, :] - self.targets[None, :, :]).max(axis=2) <= self.radius[:, None]
+        remaining = self.health.copy()
+        energy = self.energy.copy()
+        ready = self.price <= energy[self.owner]
+        columns = len(self.targets)
+        gain = np.where(reach & ready[:, None] & (remaining > 0)[None, :], self.gain(self.damage[:, None], remaining), 0)
+
+        shots = []
+        while True:
+            gun, target = divmod(int(gain.argmax()), columns)
+            if gain[gun, target] <= 0:
+                break
+
+            shots.append((gun, target))
+            remaining[target] -= self.damage[gun]
+            energy[self.owner[gun]] -= self.price[gun]
+            # после выстрела меняются только выгоды по этой цели и пушки, которым теперь не хватает энергии
+            ready[gun] = False
+            spent = ready & (self.price > energy[self.owner])
+            ready &= ~spent
+            gain[gun] = 0
+            gain[spent] = 0
+            gain[:, target] = np.where(reach[:, target] & ready & (remaining[target] > 0),
+                                       self.gain(self.damage, remaining[target]), 0)
+
+        return [(self.ships[self.owner[gun]], self.guns[gun], target) for gun, target in shots]
+
+
+# endregion
+
+
+# region Formations
+
+
+def min_cost_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Венгерский алгоритм для матрицы стоимостей (n, m), n <= m: для каждой строки - свой столбец
+    с наименьшей суммой стоимостей. Внутренний цикл по столбцам векторизован, всего O(n^2 m)
+    """
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    # owner[j] - строка (с единицы), занявшая столбец j; нулевой столбец - фиктивный
+    owner = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[column]:
+            used[column] = True
+            free = ~used
+            free[0] = False
+            reduced = cost[owner[column] - 1] - u[owner[column]] - v[1:]
+            better = free[1:] & (reduced < slack[1:])
+            slack[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, slack, np.inf)
+            following = int(candidates.argmin())
+            delta = candidates[following]
+            u[owner[used]] += delta
+            v[used] -= delta
+            slack[free] -= delta
+            column = following
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    result = np.empty(n, dtype=np.int64)
+    taken = np.nonzero(owner[1:])[0]
+    result[owner[1:][taken] - 1] = taken
+    return result
+
+
+class Formation:
+    """
+    Построения для любого числа кораблей и радиуса: кольцо (ring) и линия (line) в плоскости,
+    перпендикулярной оси `axis`, клин (wedge) остриём вдоль оси и сферическая оболочка (shell).
+    Если кораблей больше, чем помещается при заданном радиусе, построение растягивается.
+    Смещения слотов от центра строятся один раз на (форма, число кораблей, радиус, ось, поворот) и хранятся
+    в общем кэше; поворот - `step` из `steps` шагов на оборот вокруг оси.
+    Корабли назначаются на слоты по наименьшему суммарному пути (по Чебышёву, при равенстве - по евклиду),
+    и назначение пересчитывается только при смене состава флота, центра или формы, а не на каждом ходу
+    """
+    SHAPES = ('ring', 'shell', 'wedge', 'line')
+    SPACING = 2
+    slots_cache = {}
+
+    def __init__(self, shape: str = 'ring', radius: int = 4, axis=(1, 1, 1), steps: int = 18):
+        if shape not in self.SHAPES:
+            raise ValueError(f'unknown formation: {shape}')
+        self.shape = shape
+        self.radius = radius
+        self.axis = tuple(axis)
+        self.steps = steps
+        self.key = None
+        self.slot_of = {}
+
+    @staticmethod
+    def basis(axis) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Единичная ось и два перпендикулярных ей единичных вектора"""
+        a = np.asarray(axis, dtype=float)
+        a = a / np.linalg.norm(a)
+        helper = np.eye(3)[int(np.abs(a).argmin())]
+        u = np.cross(a, helper)
+        u /= np.linalg.norm(u)
+        return a, u, np.cross(a, u)
+
+    @classmethod
+    def slots(cls, shape: str, amount: int, radius: int, axis=(1, 1, 1), step: int = 0, steps: int = 18) -> np.ndarray:
+        """Смещения слотов (amount, 3) от центра построения"""
+        key = (shape, amount, radius, tuple(axis), step % steps, steps)
+        offsets = cls.slots_cache.get(key)
+        if offsets is not None:
+            return offsets
+
+        a, u, v = cls.basis(axis)
+        turn = 2 * np.pi * (step % steps) / steps
+        u, v = np.cos(turn) * u + np.sin(turn) * v, -np.sin(turn) * u + np.cos(turn) * v
+        index = np.arange(amount)
+        # если кораблей много, построение растягивается, чтобы между соседними слотами оставалось около SPACING клеток
+        if shape == 'ring':
+            radius = max(radius, cls.SPACING * amount / (2 * np.pi))
+            angle = 2 * np.pi * index / max(amount, 1)
+            points = radius * (np.cos(angle)[:, None] * u + np.sin(angle)[:, None] * v)
+        elif shape == 'shell':
+            # точки Фибоначчи на сфере: почти равномерно при любом числе
+            radius = max(radius, cls.SPACING * np.sqrt(amount / (4 * np.pi)))
+            height = 1 - 2 * (index + 0.5) / max(amount, 1)
+            angle = np.pi * (3 - np.sqrt(5)) * index
+            ring = np.sqrt(1 - height * height)
+            points = radius * (height[:, None] * a + ring[:, None] * (np.cos(angle)[:, None] * u +
+                                                                      np.sin(angle)[:, None] * v))
+        elif shape == 'wedge':
+            # остриё в центре, дальше пары кораблей по обе стороны, отступая назад вдоль оси; radius - длина крыла
+            rank = (index + 1) // 2
+            side = np.where(index % 2, 1, -1) * (index > 0)
+            spacing = max(radius / max(amount // 2, 1), cls.SPACING)
+            points = spacing * rank[:, None] * (side[:, None] * u - a) / np.sqrt(2)
+        else:
+            spacing = max(2 * radius / max(amount - 1, 1), cls.SPACING)
+            points = (index - (amount - 1) / 2)[:, None] * spacing * u
+
+        offsets = np.rint(points).astype(np.int64).reshape(-1, 3)
+        cls.slots_cache[key] = offsets
+        return offsets
+
+    def targets(self, ships: List[Ship], center: Vector, step: int = 0, map_size: int = None) -> Dict[int, Vector]:
+        """Клетка построения для каждого корабля по Id (при `map_size` - в пределах карты)"""
+        center = np.array([center.x, center.y, center.z], dtype=np.int64)
+        key = (tuple(ship.Id for ship in ships), tuple(center.tolist()), self.shape, self.radius, self.axis)
+        slots = self.slots(self.shape, len(ships), self.radius, self.axis, step, self.steps) + center
+        if key != self.key:
+            positions = np.array([(ship.Position.x, ship.Position.y, ship.Position.z) for ship in ships],
+                                 dtype=np.int64).reshape(-1, 3)
+            delta = positions[:, None, :] - slots[None, :, :]
+            chebyshev, squared = np.abs(delta).max(axis=2), (delta * delta).sum(axis=2)
+            # вес больше любой разности суммарных квадратов двух назначений, так что сумма по Чебышёву главнее
+            cost = chebyshev * (squared.max(initial=0) * len(ships) + 1) + squared
+            assigned = min_cost_assignment(cost)
+            self.slot_of = {ship.Id: int(slot) for ship, slot in zip(ships, assigned)}
+            self.key = key
+
+        if map_size is not None:
+            slots = np.clip(slots, 0, map_size - 1)
+        return {ship_id: Vector(*slots[slot].tolist()) for ship_id, slot in self.slot_of.items()}
+
+
+# endregion
+
+
 class Game:
     def __init__(self):
         self.draft_options = None
-        self.setup = 7
         self.angle = 1
+        self.formation = None
 
     def draft(self, data: dict) -> DraftChoice:
         self.draft_options = DraftOptions.from_json(data)
         draft_choice = DraftChoice()
 
         self.draft_options.PlayerId = -(self.draft_options.PlayerId or -1)  # 1 низ, -1 вверх
-
-        draft_choice.Ships = [DraftShipChoice(CompleteShipId='forward')] * 3 + \
-                             [DraftShipChoice(CompleteShipId='daedalus')] + \
-                             [DraftShipChoice(CompleteShipId='eclipse')]
+        # кольцо в плоскости, перпендикулярной диагонали, с поворотом на шаг каждый ход
+        self.formation = Formation('ring', radius=3, axis=(self.draft_options.PlayerId,) * 3, steps=15)
+
+        ship_ids = DraftOptimizer(self.draft_options).choose()
+        # корабли сразу стоят в построении: кольцо вокруг клетки в 4 от угла StartArea со стороны игрока
+        # (на карте 30 - прежние точки сбора (4, 4, 4) и (25, 25, 25)), сдвинутой так, чтобы кольцо
+        # поместилось в области; на ходы, чтобы дойти до построения, больше не тратимся
+        area = self.draft_options.StartArea
+        low, high = np.minimum(area.From.coords, area.To.coords), np.maximum(area.From.coords, area.To.coords)
+        offsets = Formation.slots(self.formation.shape, len(ship_ids), self.formation.radius, self.formation.axis,
+                                  0, self.formation.steps)
+        reach = np.abs(offsets).max(axis=0, initial=0)
+        center = low + 4 if self.draft_options.PlayerId > 0 else high - 4
+        center = np.minimum(np.maximum(center, low + reach), high - reach)
+        # пушечные корабли занимают слоты ближе к центру карты, ремонтные - там, где накрывают больше своих
+        positions = StartPlacement(self.draft_options, cells=np.clip(center + offsets, low, high)).place(ship_ids)
+        draft_choice.Ships = [DraftShipChoice(CompleteShipId=ship_id, Position=position)
+                              for ship_id, position in zip(ship_ids, positions)]
         draft_choice.Message = f'money: {self.draft_options.Money} | available ships: ' \
                                f'{", ".join(f"{ship.Id}-{ship.Price}" for ship in self.draft_options.CompleteShips)}'
 
         return draft_choice
 
-    @staticmethod
-    def attack(ship: Ship, closest_enemy: Ship, user_commands: List[Command]) -> Command or None:
-        guns = [x for x in ship.Equipment if isinstance(x, GunBlock)]
-        for gun in guns:
-            if gun.Radius * 3 >= Physics.get_len_vector(ship.Position - closest_enemy.Position):
-                user_commands.append(Command(Command=ATTACK,
-                                             Parameters=AttackParameters(Id=ship.Id,
-                                                                         Name=gun.Name,
-                                                                         Target=closest_enemy.Position)))
+    def volley(self, state: State, user_commands: List[Command]) -> None:
+        """Выстрелы всего флота, распределённые по целям; энергия, потраченная на ремонт, учитывается"""
+        blocks = {(ship.Id, block.Name): block for ship in state.My for block in ship.Equipment}
+        spent = {}
+        for command in user_commands:
+            if command.Command == ATTACK:
+                block = blocks[command.Parameters.Id, command.Parameters.Name]
+                spent[command.Parameters.Id] = spent.get(command.Parameters.Id, 0) + block.EnergyPrice
+
+        trajectories = Trajectories.of(state.Opponent, self.draft_options.MapSize, horizon=1)
+        targets = trajectories.at(1)
+        health = [enemy.Health for enemy in state.Opponent]
+        for ship, gun, target in WeaponAssignment(state.My, targets, health, spent).solve():
+            user_commands.append(Command(Command=ATTACK,
+                                         Parameters=AttackParameters(Id=ship.Id,
+                                                                     Name=gun.Name,
+                                                                     Target=trajectories.lead(target))))
 
     @staticmethod
     def heal(ship: Ship, closest_friend: Ship, user_commands: List[Command]) -> None:
@@ -505,94 +1271,83 @@ class Game:
                                                                      Name=gun.Name,
                                                                      Target=closest_friend.Position)))
 
+    @staticmethod
+    def heal_targets(state: State) -> Dict[int, Ship]:
+        """
+        Кого лечит каждый корабль с big_heal: как и прежний min по ключу `Health and расстояние <= Radius` -
+        первый корабль вне радиуса (или с нулевым здоровьем), а если таких нет - первый корабль флота
+        """
+        healers = [(index, block) for index, ship in enumerate(state.My) for block in ship.Equipment
+                   if block.Name == 'big_heal']
+        if not healers:
+            return {}
+        positions = [ship.Position for ship in state.My]
+        distances = Physics.pairwise(positions, positions)
+        alive = np.array([ship.Health != 0 for ship in state.My])
+        friends = {}
+        for index, heal in healers:
+            # у корабля с несколькими big_heal радиус берётся у первого
+            friends.setdefault(state.My[index].Id,
+                               state.My[int(((distances[index] <= heal.Radius) & alive).argmin())])
+        return friends
+
     def battle(self, data: dict) -> UserOutput:
         state = State.from_json(data)
+        PROFILER.lap('state')
         user_output = UserOutput()
         user_output.UserCommands = []
 
-        if self.setup == 7:
-            for ship in state.My:
-                user_output.UserCommands.append(Command(Command=MOVE,
-                                                        Parameters=MoveParameters(Id=ship.Id,
-                                                                                  Target=ship.Position +
-                                                                                         Vector(3, 3, 3) *
-                                                                                         self.draft_options.PlayerId)))
-
-                closest_enemy = min(state.Opponent,
-                                    key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
-                if not any([block.Name == 'big_heal' for block in ship.Equipment]):
+        center = Vector(15, 15, 15)
 
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-                else:
-                    closest_friend = list(filter(lambda x: x.Health < 80, state.My))
-                    if closest_friend:
-                        closest_friend = min(closest_friend, key=lambda x: x.Health)
-                        self.heal(ship, closest_friend, user_output.UserCommands)
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-
-            self.setup -= 1
-        elif self.setup > 0:
-            center = Vector(3, 3, 3) if self.draft_options.PlayerId > 0 else Vector(26, 26, 26)
-
-            for ship, ship_coord in zip(state.My, Physics.circle_points(center,
-                                                                        len(state.My), 0,
-                                                                        self.draft_options.PlayerId)):
-                user_output.UserCommands.append(Command(Command=MOVE,
-                                                        Parameters=MoveParameters(Id=ship.Id,
-                                                                                  Target=ship_coord)))
-                closest_enemy = min(state.Opponent,
-                                    key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
-                if not any([block.Name == 'big_heal' for block in ship.Equipment]):
-
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-                else:
-                    heal = [x for x in ship.Equipment if x.Name == 'big_heal'][0]
-                    closest_friend = min(state.My,
-                                         key=lambda x: x.Health and Physics.get_len_vector(ship.Position - x.Position)
-                                                       <= heal.Radius)
-                    self.heal(ship, closest_friend, user_output.UserCommands)
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-            self.setup -= 1
-        else:
-            center = Vector(15, 15, 15)
-
-            for ship, ship_coord in zip(state.My, Physics.circle_points(center,
-                                                                        len(state.My), self.angle,
-                                                                        self.draft_options.PlayerId)):
-                user_output.UserCommands.append(Command(Command=MOVE,
-                                                        Parameters=MoveParameters(Id=ship.Id,
-                                                                                  Target=ship_coord)))
-                closest_enemy = min(state.Opponent,
-                                    key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
-                if not any([block.Name == 'big_heal' for block in ship.Equipment]):
-
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-                else:
-                    heal = [x for x in ship.Equipment if x.Name == 'big_heal'][0]
-                    closest_friend = min(state.My,
-                                         key=lambda x: x.Health and Physics.get_len_vector(ship.Position - x.Position)
-                                                       <= heal.Radius)
-                    self.heal(ship, closest_friend, user_output.UserCommands)
-                    self.attack(ship, closest_enemy, user_output.UserCommands)
-            self.angle += 1
+        slots = self.formation.targets(state.My, center + Vector(1, 1, 1) * self.draft_options.PlayerId,
+                                       step=self.angle, map_size=self.draft_options.MapSize)
+        friends = self.heal_targets(state)
+        for ship in state.My:
+            user_output.UserCommands.append(Command(Command=MOVE,
+                                                    Parameters=MoveParameters(Id=ship.Id,
+                                                                              Target=slots[ship.Id])))
+            if ship.Id in friends:
+                self.heal(ship, friends[ship.Id], user_output.UserCommands)
+        self.angle += 1
 
+        self.volley(state, user_output.UserCommands)
         return user_output
 
-    def main(self):
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             if 'PlayerId' in data:
                 result = self.draft(data)
+                PROFILER.lap('draft')
             else:
                 result = self.battle(data)
+                PROFILER.lap('battle')
 
             line_out = json.dumps(result,
                                   default=JSONCapability.to_json,
                                   ensure_ascii=False)
-            print(line_out)
+            PROFILER.lap('encode')
+            transport.write(line_out.encode())
+            PROFILER.lap('write')
+
+            if recorder is not None:
+                # стратегия меняет словари ввода на месте, поэтому для записи кадр разбирается заново
+                recorder.record(json.loads(frame), frame, line_out.encode())
+                PROFILER.lap('record')
+
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python algos/<бот>.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -2,10 +2,17 @@
 Файл с говнокодом
 """
 
+import gzip
 import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from queue import Queue
+from typing import Iterator, List, Tuple
 from random import random
 
 
@@ -77,6 +84,270 @@ class Physics:
 # endregion
 
 
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
+
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    @staticmethod
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
+        else:
+            with open(self.target, 'a') as file:
+                file.write(self.report())
+
+
+PROFILER = Profiler(os.environ.get('PROFILE'))
+
+
+# endregion
+
+
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
+
+
+# endregion
+
+
 # region Equipment
 
 
@@ -395,6 +666,7 @@ class Game:
 
     def battle(self, data: dict) -> UserOutput:
         state = State.from_json(data)
+        PROFILER.lap('state')
         user_output = UserOutput()
 
         # так как корабли движутся, цель выбираем каждый ход
@@ -434,23 +706,43 @@ class Game:
             self.ready = True
         return user_output
 
-    def main(self):
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             # самому не нравится, но лучшего способа определить к какому этапу относится ввод организаторы не дали
             if 'PlayerId' in data:
                 result = self.draft(data)
+                PROFILER.lap('draft')
             else:
                 result = self.battle(data)
+                PROFILER.lap('battle')
 
             # не уверен так ли необходимо `ensure_ascii=False`, но оно было в примере организаторов, так что пусть будет
             line_out = json.dumps(result,
                                   default=JSONCapability.to_json,
                                   ensure_ascii=False)
-            print(line_out)
+            PROFILER.lap('encode')
+            transport.write(line_out.encode())
+            PROFILER.lap('write')
+
+            if recorder is not None:
+                # стратегия меняет словари ввода на месте, поэтому для записи кадр разбирается заново
+                recorder.record(json.loads(frame), frame, line_out.encode())
+                PROFILER.lap('record')
+
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python algos/<бот>.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
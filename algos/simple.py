@@ -3,10 +3,21 @@
 Прошу, не добавляйте сюда никакой логики поведения, иначе я обижусь
 """
 
+import gzip
+import hashlib
 import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from functools import lru_cache
+from queue import Queue
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
 
 
 # region Primitives
@@ -99,6 +110,37 @@ class Physics:
 
         return sum(value ** 2 for value in vector_diff.coords) ** 0.5
 
+    @staticmethod
+    def as_points(points) -> np.ndarray:
+        """Массив (N, 3) из массива NumPy или списка векторов"""
+        if isinstance(points, np.ndarray):
+            return points.astype(np.int64, copy=False).reshape(-1, 3)
+        return np.array([point.coords for point in points], dtype=np.int64).reshape(-1, 3)
+
+    @staticmethod
+    def pairwise(a, b, metric: str = 'euclidean') -> np.ndarray:
+        """
+        Матрица расстояний (len(a), len(b)) между двумя наборами точек.
+        Метрики: 'chebyshev' (как clen), 'manhattan' (как mlen), 'euclidean' (как get_len_vector)
+        и 'sqeuclidean' - квадрат евклидова расстояния, для сравнений без извлечения корня
+        """
+        delta = Physics.as_points(a)[:, None, :] - Physics.as_points(b)[None, :, :]
+
+        if metric == 'chebyshev':
+            return np.abs(delta).max(axis=2, initial=0)
+        elif metric == 'manhattan':
+            return np.abs(delta).sum(axis=2)
+        elif metric == 'sqeuclidean':
+            return (delta * delta).sum(axis=2)
+        elif metric == 'euclidean':
+            return np.sqrt((delta * delta).sum(axis=2))
+        raise ValueError(f'unknown metric: {metric}')
+
+    @staticmethod
+    def closest(a, b, metric: str = 'sqeuclidean') -> np.ndarray:
+        """Для каждой точки из `a` индекс ближайшей точки из `b` (при равенстве - первой, как у min)"""
+        return Physics.pairwise(a, b, metric).argmin(axis=1)
+
     @staticmethod
     def bresenham_ray(point1: Vector, point2: Vector, length: int = None) -> List[Vector]:
         """Метод для построение вектора по алгоритмы Брезенхама (https://clck.ru/Vbigh)"""
@@ -166,6 +208,270 @@ class Physics:
 # endregion
 
 
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
+
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    @staticmethod
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
+        else:
+            with open(self.target, 'a') as file:
+                file.write(self.report())
+
+
+PROFILER = Profiler(os.environ.get('PROFILE'))
+
+
+# endregion
+
+
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
+
+
+# endregion
+
+
 # region Equipment
 
 
@@ -330,6 +636,129 @@ class DraftChoice:
 # endregion
 
 
+# region Draft Planning
+
+
+# типичный урон одного попадания и число ходов, за которые оценивается ремонт, для `combat_value`
+TYPICAL_DAMAGE = 6
+HEAL_TURNS = 10
+
+
+def combat_value(blocks: List[Block]) -> float:
+    """
+    Оценка силы корабля в замкнутой форме: урон за ход, на который хватает восполняемой энергии,
+    умноженный на эффективное здоровье (щит снижает урон каждого попадания на Armor,
+    ремонт на оставшуюся энергию добавляет здоровье) и на подвижность.
+    Блоки различаются по полям, поэтому оценка не зависит от того, какие классы блоков знает стратегия
+    """
+    health = sum(getattr(block, 'MaxHealth', 0) for block in blocks)
+    income = sum(getattr(block, 'IncrementPerTurn', 0) for block in blocks)
+    accelerate = sum(getattr(block, 'MaxAccelerate', 0) for block in blocks)
+    guns = [block for block in blocks if hasattr(block, 'Damage')]
+    shields = [block for block in blocks if hasattr(block, 'Armor')]
+    heals = [block for block in blocks if hasattr(block, 'HealthGain')]
+
+    # энергия в первую очередь идёт на пушки, остаток - на щит, затем на ремонт
+    damage = sum(gun.Damage for gun in guns)
+    price = sum(gun.EnergyPrice for gun in guns)
+    share = min(1.0, income / price) if price else 1.0
+    income -= price * share
+
+    armor = 0
+    for shield in sorted(shields, key=lambda block: -block.Armor):
+        if income >= shield.EnergyPrice:
+            armor, income = shield.Armor, income - shield.EnergyPrice
+            break
+    for heal in heals:
+        if heal.EnergyPrice:
+            health += HEAL_TURNS * heal.HealthGain * min(1.0, income / heal.EnergyPrice)
+            income -= min(income, heal.EnergyPrice)
+
+    effective = health * TYPICAL_DAMAGE / max(TYPICAL_DAMAGE - armor, 1)
+    return damage * share * effective * (1 + 0.1 * accelerate)
+
+
+class DraftOptimizer:
+    """
+    Набор кораблей из CompleteShips как ограниченный рюкзак: суммарная цена не больше Money,
+    кораблей не больше MaxShipsCount, каждый вид можно брать несколько раз, ценность - `value` от блоков корабля.
+    Доминируемые корабли (не дешевле и не ценнее другого) отбрасываются, остальное решает динамика
+    с запоминанием по (вид, остаток денег, остаток мест). Ответы кэшируются на диске по хэшу условий,
+    потому что каталог от матча к матчу обычно не меняется
+    """
+    CACHE = os.environ.get('DRAFT_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'draft_cache.json'))
+
+    def __init__(self, options: DraftOptions, value: Callable[[List[Block]], float] = combat_value):
+        self.options = options
+        self.value = value
+        blocks = {item.Equipment.Name: item.Equipment for item in options.Equipment}
+        self.values = {ship.Id: value([blocks[name] for name in ship.Equipment if name in blocks])
+                       for ship in options.CompleteShips}
+
+    def key(self) -> str:
+        catalog = [(ship.Id, ship.Price, self.values[ship.Id]) for ship in self.options.CompleteShips]
+        data = json.dumps([self.options.Money, self.options.MaxShipsCount, getattr(self.value, '__name__', ''),
+                           catalog], sort_keys=True)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def candidates(self) -> List[DraftCompleteShip]:
+        """Корабли, которых не доминирует никакой другой; при равенстве остаётся первый по каталогу"""
+        ships = sorted(self.options.CompleteShips, key=lambda ship: (ship.Price, -self.values[ship.Id]))
+        kept, best = [], float('-inf')
+        for ship in ships:
+            if self.values[ship.Id] > best and ship.Price <= self.options.Money:
+                kept.append(ship)
+                best = self.values[ship.Id]
+        return kept
+
+    def solve(self) -> List[str]:
+        """Id кораблей набора, от самых ценных"""
+        ships = self.candidates()
+        prices = [ship.Price for ship in ships]
+        values = [self.values[ship.Id] for ship in ships]
+
+        @lru_cache(maxsize=None)
+        def best(index: int, money: int, slots: int) -> Tuple[float, Tuple[int, ...]]:
+            if index == len(ships) or not slots:
+                return 0.0, ()
+            result = (float('-inf'), ())
+            # бесплатных кораблей можно взять сколько угодно, их ограничивают только места
+            limit = min(slots, money // prices[index]) if prices[index] > 0 else slots
+            for count in range(limit + 1):
+                value, counts = best(index + 1, money - count * prices[index], slots - count)
+                if value + count * values[index] > result[0]:
+                    result = (value + count * values[index], (count, *counts))
+            return result
+
+        _, counts = best(0, self.options.Money, self.options.MaxShipsCount)
+        chosen = [ship.Id for ship, count in zip(ships, counts) for _ in range(count)]
+        return sorted(chosen, key=lambda ship_id: -self.values[ship_id])
+
+    def choose(self) -> List[str]:
+        """`solve` через дисковый кэш; недоступный для записи кэш просто не используется"""
+        key = self.key()
+        try:
+            with open(self.CACHE) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            cache = {}
+        if key in cache:
+            return cache[key]
+
+        cache[key] = self.solve()
+        try:
+            temporary = f'{self.CACHE}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(cache, file)
+            os.replace(temporary, self.CACHE)
+        except OSError:
+            pass
+        return cache[key]
+
+
+# endregion
+
+
 # region Battle Input
 
 
@@ -382,6 +811,61 @@ class State(JSONCapability):
 # endregion
 
 
+# region Fleet Arrays
+
+
+class Trajectories:
+    """
+    Прогноз положений кораблей на 0..horizon ходов вперёд при неизменной скорости, сразу для всех кораблей.
+    Упёршись в стену, корабль по этой оси останавливается, поэтому положение через t ходов -
+    просто `Position + t * Velocity`, обрезанное по границам карты.
+    `spread[t, i]` - на сколько клеток по каждой оси i-й корабль может уйти от прогноза за t ходов,
+    если будет ускоряться: a + 2a + ... + ta при его наибольшем ускорении a
+    """
+
+    def __init__(self, positions, velocities, map_size: int, accelerate, horizon: int = 8):
+        self.base = Physics.as_points(positions)
+        self.velocity = Physics.as_points(velocities)
+        self.high = map_size - 1
+        self.accelerate = np.broadcast_to(np.asarray(accelerate, dtype=np.int64), len(self.base))
+        self.extend(horizon)
+
+    def extend(self, horizon: int) -> None:
+        turns = np.arange(horizon + 1)
+        self.positions = np.clip(self.base[None, :, :] + turns[:, None, None] * self.velocity[None, :, :],
+                                 0, self.high)
+        self.spread = (turns * (turns + 1) // 2)[:, None] * self.accelerate[None, :]
+
+    @classmethod
+    def of(cls, ships: List[Ship], map_size: int, accelerate: int = 0, horizon: int = 8):
+        """
+        Прогноз для списка кораблей; ускорение берётся из их двигателей,
+        а для кораблей со скрытым снаряжением (оппонент) - `accelerate`
+        """
+        accelerations = []
+        for ship in ships:
+            if ship.Equipment is None:
+                accelerations.append(accelerate)
+            else:
+                accelerations.append(sum(block.MaxAccelerate for block in ship.Equipment
+                                         if isinstance(block, EngineBlock)))
+        return cls([ship.Position for ship in ships], [ship.Velocity for ship in ships],
+                   map_size, accelerations, horizon)
+
+    def at(self, turns: int) -> np.ndarray:
+        """Положения (N, 3) через `turns` ходов"""
+        if turns >= len(self.positions):
+            self.extend(max(turns, 2 * (len(self.positions) - 1)))
+        return self.positions[turns]
+
+    def lead(self, index: int, turns: int = 1) -> Vector:
+        """Куда целиться в `index`-й корабль: урон считается по положениям после хода, то есть через один ход"""
+        return Vector(*self.at(turns)[index].tolist())
+
+
+# endregion
+
+
 # region Battle Output
 
 
@@ -429,6 +913,83 @@ class UserOutput(JSONCapability):
 # endregion
 
 
+# region Targeting
+
+
+class WeaponAssignment:
+    """
+    Распределение выстрелов всего флота по целям на ход (weapon-target assignment) вместо выбора цели каждым кораблём.
+    Жадно по предельной выгоде: на каждом шаге берётся пара (пушка, цель) с наибольшим полезным уроном -
+    не больше оставшегося здоровья цели, с надбавкой за добивание, - затем здоровье цели и энергия корабля
+    уменьшаются, а пушка выбывает. Выгоды всех пар пересчитываются одной операцией над матрицей (пушки x цели).
+    Дальность проверяется по метрике Чебышёва от текущего положения корабля, а цель - клетка, где корабль оппонента
+    окажется после хода (урон считается по положениям после перемещения)
+    """
+    KILL_BONUS = 10
+
+    def __init__(self, ships: List[Ship], targets, health, spent: Dict[int, int] = None):
+        """
+        `targets` - клетки (T, 3) для кораблей оппонента, `health` - их здоровье,
+        `spent` - энергия по Id корабля, уже потраченная на другие команды этого хода
+        """
+        spent = spent or {}
+        self.ships = ships
+        self.guns, owners = [], []
+        for index, ship in enumerate(ships):
+            for block in ship.Equipment or ():
+                if isinstance(block, GunBlock):
+                    self.guns.append(block)
+                    owners.append(index)
+
+        self.owner = np.array(owners, dtype=np.int64)
+        self.damage = np.array([gun.Damage for gun in self.guns], dtype=np.int64)
+        self.radius = np.array([gun.Radius for gun in self.guns], dtype=np.int64)
+        self.price = np.array([gun.EnergyPrice for gun in self.guns], dtype=np.int64)
+        self.origin = np.array([(ship.Position.x, ship.Position.y, ship.Position.z) for ship in ships],
+                               dtype=np.int64).reshape(-1, 3)[self.owner]
+        self.energy = np.array([(ship.Energy or 0) - spent.get(ship.Id, 0) for ship in ships], dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64).reshape(-1, 3)
+        self.health = np.asarray(health, dtype=np.int64)
+
+    def gain(self, damage, health):
+        """Полезный урон: сверх оставшегося здоровья не засчитывается, добивание поощряется"""
+        return np.minimum(damage, health) + self.KILL_BONUS * (damage >= health)
+
+    def solve(self) -> List[Tuple[Ship, GunBlock, int]]:
+        """Выстрелы в виде (корабль, пушка, индекс цели); пушки без полезной цели не стреляют"""
+        if not len(self.guns) or not len(self.targets):
+            return []
+        reach = np.abs(self.origin[:, None, :] - self.targets[None, :, :]).max(axis=2) <= self.radius[:, None]
+        remaining = self.health.copy()
+        energy = self.energy.copy()
+        ready = self.price <= energy[self.owner]
+        columns = len(self.targets)
+        gain = np.where(reach & ready[:, None] & (remaining > 0)[None, :], self.gain(self.damage[:, None], remaining), 0)
+
+        shots = []
+        while True:
+            gun, target = divmod(int(gain.argmax()), columns)
+            if gain[gun, target] <= 0:
+                break
+
+            shots.append((gun, target))
+            remaining[target] -= self.damage[gun]
+            energy[self.owner[gun]] -= self.price[gun]
+            # после выстрела меняются только выгоды по этой цели и пушки, которым теперь не хватает энергии
+            ready[gun] = False
+            spent = ready & (self.price > energy[self.owner])
+            ready &= ~spent
+            gain[gun] = 0
+            gain[spent] = 0
+            gain[:, target] = np.where(reach[:, target] & ready & (remaining[target] > 0),
+                                       self.gain(self.damage, remaining[target]), 0)
+
+        return [(self.ships[self.owner[gun]], self.guns[gun], target) for gun, target in shots]
+
+
+# endregion
+
+
 class Game:
     def __init__(self):
         self.draft_options = None
@@ -436,49 +997,73 @@ class Game:
     def draft(self, data: dict) -> DraftChoice:
         self.draft_options = DraftOptions.from_json(data)
 
-        draft_choice = DraftChoice([DraftShipChoice(CompleteShipId='forward')] * 5)
+        draft_choice = DraftChoice([DraftShipChoice(CompleteShipId=ship_id)
+                                    for ship_id in DraftOptimizer(self.draft_options).choose()])
         return draft_choice
 
     def battle(self, data: dict) -> UserOutput:
         state = State.from_json(data)
+        PROFILER.lap('state')
         user_output = UserOutput()
         user_output.UserCommands = []
 
-        for ship in state.My:
-            nearest_enemy = min(state.Opponent, key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
+        # ближайший оппонент для каждого корабля - одной матрицей расстояний на весь флот
+        nearest = Physics.closest([ship.Position for ship in state.My], [enemy.Position for enemy in state.Opponent])
+        for ship, index in zip(state.My, nearest.tolist()):
+            nearest_enemy = state.Opponent[index]
 
             # перемещение
             user_output.UserCommands.append(Command(Command=MOVE,
                                                     Parameters=MoveParameters(Id=ship.Id,
                                                                               Target=nearest_enemy.Position)))
 
-            # атака
-            if ship.Energy >= 20:
-                guns = [x for x in ship.Equipment if isinstance(x, GunBlock)]
-                for gun in guns:
-                    if gun.Radius < Physics.get_len_vector(ship.Position - nearest_enemy.Position) + 2:
-                        user_output.UserCommands.append(Command(Command=ATTACK,
-                                                                Parameters=AttackParameters(Id=ship.Id,
-                                                                                            Name=gun.Name,
-                                                                                            Target=nearest_enemy.Position)))
+        # атака: цели для всех пушек флота выбираются вместе, чтобы не добивать одного и того же
+        trajectories = Trajectories.of(state.Opponent, self.draft_options.MapSize, horizon=1)
+        targets = trajectories.at(1)
+        health = [enemy.Health for enemy in state.Opponent]
+        for ship, gun, target in WeaponAssignment(state.My, targets, health).solve():
+            user_output.UserCommands.append(Command(Command=ATTACK,
+                                                    Parameters=AttackParameters(Id=ship.Id,
+                                                                                Name=gun.Name,
+                                                                                Target=trajectories.lead(target))))
 
         return user_output
 
-    def main(self):
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             if 'PlayerId' in data:
                 result = self.draft(data)
+                PROFILER.lap('draft')
             else:
                 result = self.battle(data)
+                PROFILER.lap('battle')
 
             line_out = json.dumps(result,
                                   default=JSONCapability.to_json,
                                   ensure_ascii=False)
-            print(line_out)
+            PROFILER.lap('encode')
+            transport.write(line_out.encode())
+            PROFILER.lap('write')
+
+            if recorder is not None:
+                # стратегия меняет словари ввода на месте, поэтому для записи кадр разбирается заново
+                recorder.record(json.loads(frame), frame, line_out.encode())
+                PROFILER.lap('record')
+
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python algos/<бот>.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -2,12 +2,21 @@
 Основаная идея заключалается в отстреле кораблей противника по одному
 """
 
+import gzip
 import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from queue import Queue
+from typing import Dict, Iterator, List, Tuple
 from random import random
 
+import numpy as np
+
 
 # region Primitives
 
@@ -77,6 +86,270 @@ class Physics:
 # endregion
 
 
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
+
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    @staticmethod
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
+        else:
+            with open(self.target, 'a') as file:
+                file.write(self.report())
+
+
+PROFILER = Profiler(os.environ.get('PROFILE'))
+
+
+# endregion
+
+
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
+
+
+# endregion
+
+
 # region Equipment
 
 
@@ -317,9 +590,275 @@ class UserOutput(JSONCapability):
 # endregion
 
 
+# region Focus Fire
+
+
+class FocusFire:
+    """
+    Порядок уничтожения оппонентов: для каждого оценивается, за сколько ходов его добьёт весь флот,
+    если корабль, до которого пушка не достаёт, подлетает к цели на клетку за ход.
+    Цели берутся с упреждением на ход (урон считается по положениям после перемещения).
+    Расстояния хранятся между ходами и пересчитываются только для сдвинувшихся кораблей,
+    а цель меняется, только если другую теперь можно уничтожить быстрее
+    """
+    # дальше этого числа ходов оценка не заглядывает
+    HORIZON = 30
+
+    def __init__(self, map_size: int = 30):
+        self.map_size = map_size
+        self.my_ids, self.enemy_ids = [], []
+        self.my = np.zeros((0, 3), dtype=np.int64)
+        self.enemy = np.zeros((0, 3), dtype=np.int64)
+        # положения оппонентов без упреждения
+        self.current = np.zeros((0, 3), dtype=np.int64)
+        self.distance = np.zeros((0, 0), dtype=np.int64)
+        self.target = None
+        self.health = np.zeros(0, dtype=np.int64)
+        self.turns = np.zeros(0, dtype=np.int64)
+        # урон (строка) и дальность (столбец) пушек наших кораблей, посчитанные для флота `guns_of`
+        self.guns_of = None
+        self.damage = np.zeros(0, dtype=np.int64)
+        self.radius = np.zeros((0, 1), dtype=np.int64)
+        self.armed = False
+
+    @staticmethod
+    def snapshot(ships: List[Ship]) -> np.ndarray:
+        """Строки (x, y, z, vx, vy, vz, health) кораблей"""
+        return np.array([(ship.Position.x, ship.Position.y, ship.Position.z, ship.Velocity.x, ship.Velocity.y,
+                          ship.Velocity.z, ship.Health) for ship in ships], dtype=np.int64).reshape(-1, 7)
+
+    @staticmethod
+    def chebyshev(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return np.abs(a[:, None, :] - b[None, :, :]).max(axis=2, initial=0)
+
+    def track(self, state: State) -> None:
+        """Матрица расстояний (наши корабли x цели) с пересчётом только изменившихся строк и столбцов"""
+        # оба флота - одним массивом, так на малых флотах меньше накладных расходов numpy
+        snapshot = self.snapshot(state.My + state.Opponent)
+        my, opponent = snapshot[:len(state.My), :3], snapshot[len(state.My):]
+        self.current, self.health = opponent[:, :3], opponent[:, 6]
+        enemy = np.minimum(np.maximum(opponent[:, :3] + opponent[:, 3:6], 0), self.map_size - 1)
+        my_ids, enemy_ids = [ship.Id for ship in state.My], [ship.Id for ship in state.Opponent]
+
+        # если сдвинулись все корабли одной из сторон, одна полная матрица дешевле двух частичных
+        rows = columns = None
+        if my_ids == self.my_ids and enemy_ids == self.enemy_ids:
+            rows = (my != self.my).any(axis=1)
+            if not rows.all():
+                columns = (enemy != self.enemy).any(axis=1)
+        if columns is None or columns.all():
+            self.distance = self.chebyshev(my, enemy)
+        else:
+            if rows.any():
+                self.distance[rows] = self.chebyshev(my[rows], enemy)
+            if columns.any():
+                self.distance[:, columns] = self.chebyshev(my, enemy[columns])
+        self.my, self.enemy, self.my_ids, self.enemy_ids = my, enemy, my_ids, enemy_ids
+
+    def update(self, state: State, guns: List[GunBlock]) -> int:
+        """
+        Индекс цели в state.Opponent; `guns[i]` - пушка, из которой стреляет i-й корабль (None - без пушки).
+        После вызова `turns[j]` - оценка числа ходов до уничтожения j-го оппонента
+        """
+        self.track(state)
+        # пушки меняются только вместе с составом флота; кораблям без урона подлёт ставится дальше любого
+        # другого, чтобы при сортировке они шли последними и ничего не меняли в оценке
+        if self.guns_of != self.my_ids:
+            self.damage = np.array([gun.Damage if gun else 0 for gun in guns], dtype=np.int64)
+            self.radius = np.array([gun.Radius if gun and gun.Damage > 0 else -self.map_size - self.HORIZON
+                                    for gun in guns], dtype=np.int64).reshape(-1, 1)
+            self.armed, self.guns_of = bool(self.damage.any()), self.my_ids
+        health = self.health
+        if not self.armed:
+            self.turns = np.where(health > 0, self.HORIZON + 1, 1)
+        else:
+            # approach[i, j] - ходов до того, как i-й корабль достанет до j-го оппонента
+            approach = np.maximum(self.distance - self.radius, 0)
+            # к ходу t урон по j-му - кусочно-линейная функция: сумма damage * (t - approach) по уже достающим
+            # кораблям. Корабли сортируются по подлёту, и для первых k из них ход уничтожения решается в целых
+            # числах; минимум по k совпадает с перебором ходов до HORIZON, но без тензора ходы x корабли x оппоненты
+            start = np.sort(approach, axis=0)
+            rate = self.damage[np.argsort(approach, axis=0, kind='stable')]
+            total, weighted = np.cumsum(rate, axis=0), np.cumsum(rate * start, axis=0)
+            turns = np.maximum(-(-(health + weighted) // total), start).min(axis=0, initial=self.HORIZON + 1)
+            self.turns = np.where(health > 0, np.minimum(turns, self.HORIZON + 1), 1)
+
+        fastest = self.turns.min(initial=self.HORIZON + 1)
+        if self.target in self.enemy_ids:
+            current = self.enemy_ids.index(self.target)
+            if fastest >= self.turns[current]:
+                return current
+
+        best = int(self.turns.argmin())
+        if np.count_nonzero(self.turns == fastest) > 1:
+            # при равенстве - прежний критерий: сумма евклидовых расстояний от флота до текущего положения оппонента
+            offsets = self.my[:, None, :] - self.current[None, :, :]
+            spread = np.sqrt((offsets * offsets).sum(axis=2)).sum(axis=0)
+            best = int(np.lexsort((spread, self.turns))[0])
+        self.target = self.enemy_ids[best]
+        return best
+
+    def aim(self, index: int) -> Vector:
+        """Клетка, куда стрелять по `index`-му оппоненту"""
+        return Vector(*self.enemy[index].tolist())
+
+    def closest(self) -> List[int]:
+        """Для каждого нашего корабля - индекс ближайшего оппонента (по Чебышёву, с упреждением на ход)"""
+        return self.distance.argmin(axis=1).tolist()
+
+    def reaches(self, index: int) -> List[bool]:
+        """Для каждого нашего корабля - достаёт ли его пушка до `index`-го оппонента"""
+        return (self.distance[:, index] <= self.radius[:, 0]).tolist()
+
+
+# endregion
+
+
+# region Formations
+
+
+def min_cost_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Венгерский алгоритм для матрицы стоимостей (n, m), n <= m: для каждой строки - свой столбец
+    с наименьшей суммой стоимостей. Внутренний цикл по столбцам векторизован, всего O(n^2 m)
+    """
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    # owner[j] - строка (с единицы), занявшая столбец j; нулевой столбец - фиктивный
+    owner = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[column]:
+            used[column] = True
+            free = ~used
+            free[0] = False
+            reduced = cost[owner[column] - 1] - u[owner[column]] - v[1:]
+            better = free[1:] & (reduced < slack[1:])
+            slack[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, slack, np.inf)
+            following = int(candidates.argmin())
+            delta = candidates[following]
+            u[owner[used]] += delta
+            v[used] -= delta
+            slack[free] -= delta
+            column = following
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    result = np.empty(n, dtype=np.int64)
+    taken = np.nonzero(owner[1:])[0]
+    result[owner[1:][taken] - 1] = taken
+    return result
+
+
+class Formation:
+    """
+    Построения для любого числа кораблей и радиуса: кольцо (ring) и линия (line) в плоскости,
+    перпендикулярной оси `axis`, клин (wedge) остриём вдоль оси и сферическая оболочка (shell).
+    Если кораблей больше, чем помещается при заданном радиусе, построение растягивается.
+    Смещения слотов от центра строятся один раз на (форма, число кораблей, радиус, ось, поворот) и хранятся
+    в общем кэше; поворот - `step` из `steps` шагов на оборот вокруг оси.
+    Корабли назначаются на слоты по наименьшему суммарному пути (по Чебышёву, при равенстве - по евклиду),
+    и назначение пересчитывается только при смене состава флота, центра или формы, а не на каждом ходу
+    """
+    SHAPES = ('ring', 'shell', 'wedge', 'line')
+    SPACING = 2
+    slots_cache = {}
+
+    def __init__(self, shape: str = 'ring', radius: int = 4, axis=(1, 1, 1), steps: int = 18):
+        if shape not in self.SHAPES:
+            raise ValueError(f'unknown formation: {shape}')
+        self.shape = shape
+        self.radius = radius
+        self.axis = tuple(axis)
+        self.steps = steps
+        self.key = None
+        self.slot_of = {}
+
+    @staticmethod
+    def basis(axis) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Единичная ось и два перпендикулярных ей единичных вектора"""
+        a = np.asarray(axis, dtype=float)
+        a = a / np.linalg.norm(a)
+        helper = np.eye(3)[int(np.abs(a).argmin())]
+        u = np.cross(a, helper)
+        u /= np.linalg.norm(u)
+        return a, u, np.cross(a, u)
+
+    @classmethod
+    def slots(cls, shape: str, amount: int, radius: int, axis=(1, 1, 1), step: int = 0, steps: int = 18) -> np.ndarray:
+        """Смещения слотов (amount, 3) от центра построения"""
+        key = (shape, amount, radius, tuple(axis), step % steps, steps)
+        offsets = cls.slots_cache.get(key)
+        if offsets is not None:
+            return offsets
+
+        a, u, v = cls.basis(axis)
+        turn = 2 * np.pi * (step % steps) / steps
+        u, v = np.cos(turn) * u + np.sin(turn) * v, -np.sin(turn) * u + np.cos(turn) * v
+        index = np.arange(amount)
+        # если кораблей много, построение растягивается, чтобы между соседними слотами оставалось около SPACING клеток
+        if shape == 'ring':
+            radius = max(radius, cls.SPACING * amount / (2 * np.pi))
+            angle = 2 * np.pi * index / max(amount, 1)
+            points = radius * (np.cos(angle)[:, None] * u + np.sin(angle)[:, None] * v)
+        elif shape == 'shell':
+            # точки Фибоначчи на сфере: почти равномерно при любом числе
+            radius = max(radius, cls.SPACING * np.sqrt(amount / (4 * np.pi)))
+            height = 1 - 2 * (index + 0.5) / max(amount, 1)
+            angle = np.pi * (3 - np.sqrt(5)) * index
+            ring = np.sqrt(1 - height * height)
+            points = radius * (height[:, None] * a + ring[:, None] * (np.cos(angle)[:, None] * u +
+                                                                      np.sin(angle)[:, None] * v))
+        elif shape == 'wedge':
+            # остриё в центре, дальше пары кораблей по обе стороны, отступая назад вдоль оси; radius - длина крыла
+            rank = (index + 1) // 2
+            side = np.where(index % 2, 1, -1) * (index > 0)
+            spacing = max(radius / max(amount // 2, 1), cls.SPACING)
+            points = spacing * rank[:, None] * (side[:, None] * u - a) / np.sqrt(2)
+        else:
+            spacing = max(2 * radius / max(amount - 1, 1), cls.SPACING)
+            points = (index - (amount - 1) / 2)[:, None] * spacing * u
+
+        offsets = np.rint(points).astype(np.int64).reshape(-1, 3)
+        cls.slots_cache[key] = offsets
+        return offsets
+
+    def targets(self, ships: List[Ship], center: Vector, step: int = 0, map_size: int = None) -> Dict[int, Vector]:
+        """Клетка построения для каждого корабля по Id (при `map_size` - в пределах карты)"""
+        center = np.array([center.x, center.y, center.z], dtype=np.int64)
+        key = (tuple(ship.Id for ship in ships), tuple(center.tolist()), self.shape, self.radius, self.axis)
+        slots = self.slots(self.shape, len(ships), self.radius, self.axis, step, self.steps) + center
+        if key != self.key:
+            positions = np.array([(ship.Position.x, ship.Position.y, ship.Position.z) for ship in ships],
+                                 dtype=np.int64).reshape(-1, 3)
+            delta = positions[:, None, :] - slots[None, :, :]
+            chebyshev, squared = np.abs(delta).max(axis=2), (delta * delta).sum(axis=2)
+            # вес больше любой разности суммарных квадратов двух назначений, так что сумма по Чебышёву главнее
+            cost = chebyshev * (squared.max(initial=0) * len(ships) + 1) + squared
+            assigned = min_cost_assignment(cost)
+            self.slot_of = {ship.Id: int(slot) for ship, slot in zip(ships, assigned)}
+            self.key = key
+
+        if map_size is not None:
+            slots = np.clip(slots, 0, map_size - 1)
+        return {ship_id: Vector(*slots[slot].tolist()) for ship_id, slot in self.slot_of.items()}
+
+
+# endregion
+
+
 class Game:
     def __init__(self):
         self.targeted = None
+        self.focus = FocusFire()
         # вес ближайшего врага ко всем
         self.main_particle_weight = 0.9
         # вес ближайшего врага к конкретной частице
@@ -328,9 +867,18 @@ class Game:
         self.ready = False
         # счетчик ходов
         self.ready_commands = 0
-
-    @staticmethod
-    def draft(_: dict) -> DraftChoice:
+        # построение в стартовой зоне на первых ходах
+        self.formation = None
+        self.rally = None
+
+    def draft(self, data: dict) -> DraftChoice:
+        self.focus = FocusFire(data['MapSize'])
+        # клин собирается в середине стартовой зоны остриём к центру карты
+        area = MapRegion.from_json(data['StartArea'])
+        middle = (np.array(area.From.coords) + np.array(area.To.coords)) // 2
+        self.rally = Vector(*middle.tolist())
+        axis = np.sign(data['MapSize'] // 2 - middle)
+        self.formation = Formation('wedge', radius=4, axis=tuple(axis.tolist()) if axis.any() else (1, 1, 1))
         return DraftChoice()  # корабли набираются автоматически
 
     def velocity_change(self, closest_enemy: Ship, ship: Ship) -> dict:
@@ -348,81 +896,45 @@ class Game:
                       main_particle_weight_coeff * random() * (targeted_position_raw[key] - ship_position_raw[key]))
                 for key, value in ship.Velocity.__dict__.items()}
 
-    def building_ships(self, ship: Ship) -> Command:
-        # самому не нравится, как это все работает, но другого способа не придумал
-        # функция, которая занимается постраеним кораблей
-        if ship.Id == 0:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(0, 0, 7)))
-        elif ship.Id == 4:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(8, 0, 8)))
-        elif ship.Id == 1:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector((2 if self.ready_commands <= 2 else 0), 8, 2)))
-        elif ship.Id == 3:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector((6 if self.ready_commands <= 2 else 8), 8, 1)))
-        elif ship.Id == 2:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(4, 4, 0)))
-
-        if ship.Id == 10000:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(28, 28, 21)))
-        elif ship.Id == 10004:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(20, 28, 20)))
-        elif ship.Id == 10001:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector((26 if self.ready_commands <= 2 else 28), 20, 26)))
-        elif ship.Id == 10003:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector((22 if self.ready_commands <= 2 else 20), 20, 27)))
-        elif ship.Id == 10002:
-            return Command(Command=MOVE,
-                           Parameters=MoveParameters(Id=ship.Id,
-                                                     Target=Vector(24, 24, 28)))
-
     def battle(self, data: dict) -> UserOutput:
         state = State.from_json(data)
+        PROFILER.lap('state')
         user_output = UserOutput()
 
-        # так как корабли движутся, цель выбираем каждый ход
-        # сумма расстояний от всех кораблей до новой жертвы должна быть наименьшей
-        self.targeted = min(state.Opponent,
-                            key=lambda x: sum([Physics.get_len_vector(y.Position - x.Position) for y in state.My]))
-
-        user_output.UserCommands = []
-        for ship in state.My:
-            guns = [x for x in ship.Equipment if isinstance(x, GunBlock)]
+        # цель - оппонент, которого флот уничтожит быстрее всех; меняется, только когда появляется более быстрая
+        guns = [max([x for x in ship.Equipment if isinstance(x, GunBlock)], key=lambda x: x.Radius, default=None)
+                for ship in state.My]
+        target = self.focus.update(state, guns)
+        self.targeted = state.Opponent[target]
+        aim = self.focus.aim(target)
+        slots = self.formation.targets(state.My, self.rally, map_size=self.focus.map_size) if not self.ready else {}
 
-            if guns:
-                # корабль выбирает оружие с наибольшей дальностью
-                ranged_gun = max(guns, key=lambda x: x.Radius)
+        # ближайшие оппоненты и досягаемость цели - из матрицы расстояний FocusFire
+        closest, reaches = self.focus.closest(), self.focus.reaches(target)
 
-                # ближайший оппонент к текущему кораблю
-                closest_enemy = min(state.Opponent, key=lambda x: Physics.get_len_vector(ship.Position - x.Position))
+        user_output.UserCommands = []
+        for ship, ranged_gun, nearest, in_range in zip(state.My, guns, closest, reaches):
+            # корабль стреляет из оружия с наибольшей дальностью
+            if ranged_gun:
+                closest_enemy = state.Opponent[nearest]
 
+                if in_range:
+                    user_output.UserCommands.append(Command(Command=ATTACK,
+                                                            Parameters=AttackParameters(
+                                                                Id=ship.Id,
+                                                                Name=ranged_gun.Name,
+                                                                Target=aim)))
                 # Проверка, что оружие достанет до "жертвы" (взял с запасом)
-                if ranged_gun.Radius * 3 >= Physics.get_len_vector(ship.Position - closest_enemy.Position):
+                elif ranged_gun.Radius * 3 >= Physics.get_len_vector(ship.Position - closest_enemy.Position):
                     user_output.UserCommands.append(Command(Command=ATTACK,
                                                             Parameters=AttackParameters(
                                                                 Id=ship.Id,
                                                                 Name=ranged_gun.Name,
                                                                 Target=closest_enemy.Position)))
-                # костыль, как и многое, что тут есть
                 if not self.ready:
-                    user_output.UserCommands.append(self.building_ships(ship))
+                    user_output.UserCommands.append(Command(Command=MOVE,
+                                                            Parameters=MoveParameters(Id=ship.Id,
+                                                                                      Target=slots[ship.Id])))
                 else:
                     ship.Velocity.x, ship.Velocity.y, ship.Velocity.z = self.velocity_change(closest_enemy,
                                                                                              ship).values()
@@ -434,23 +946,43 @@ class Game:
             self.ready = True
         return user_output
 
-    def main(self):
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             # самому не нравится, но лучшего способа определить к какому этапу относится ввод организаторы не дали
             if 'PlayerId' in data:
                 result = self.draft(data)
+                PROFILER.lap('draft')
             else:
                 result = self.battle(data)
+                PROFILER.lap('battle')
 
             # не уверен так ли необходимо `ensure_ascii=False`, но оно было в примере организаторов, так что пусть будет
             line_out = json.dumps(result,
                                   default=JSONCapability.to_json,
                                   ensure_ascii=False)
-            print(line_out)
+            PROFILER.lap('encode')
+            transport.write(line_out.encode())
+            PROFILER.lap('write')
+
+            if recorder is not None:
+                # стратегия меняет словари ввода на месте, поэтому для записи кадр разбирается заново
+                recorder.record(json.loads(frame), frame, line_out.encode())
+                PROFILER.lap('record')
+
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python algos/<бот>.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,322 @@
+"""
+Замеры на синтетических состояниях:
+    python bench.py codec [--ships 5 10 50] [--seconds 1] - разбор хода и сериализация ответа
+    python bench.py strategies [--save] - задержки draft и battle стратегий из algos/ и examples/
+        в сравнении с сохранённым базовым замером (bench_baseline.json)
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from engine import Engine, load_module
+from sample import (ATTACK, MOVE, AttackParameters, BlockType, Command, EnergyBlock, EngineBlock, FireInfo, GunBlock,
+                    HealBlock, HealthBlock, JSONCapability, MoveParameters, RadarBlock, Ship, ShieldBlock, State,
+                    UserOutput, Vector, encode)
+
+
+# region Synthetic input
+
+
+BLOCKS = [
+    {'Name': 'small_energy', 'Type': 0, 'IncrementPerTurn': 12, 'MaxEnergy': 100, 'StartEnergy': 100},
+    {'Name': 'small_gun', 'Type': 1, 'Damage': 5, 'EnergyPrice': 20, 'Radius': 5, 'EffectType': 0},
+    {'Name': 'big_gun', 'Type': 1, 'Damage': 12, 'EnergyPrice': 50, 'Radius': 3, 'EffectType': 1},
+    {'Name': 'small_engine', 'Type': 2, 'MaxAccelerate': 1},
+    {'Name': 'small_health', 'Type': 3, 'MaxHealth': 100, 'StartHealth': 100},
+    {'Name': 'small_shield', 'Type': 4, 'EnergyPrice': 10, 'Armor': 2},
+    {'Name': 'big_heal', 'Type': 7, 'EnergyPrice': 30, 'Radius': 4, 'HealthGain': 10, 'EnergyGain': 0},
+]
+
+
+def random_vector(rnd: random.Random, map_size: int, low: int = 0) -> str:
+    return '/'.join(str(rnd.randint(low, map_size - 1)) for _ in range(3))
+
+
+# наборы снаряжения: старые стратегии (targeting.py, shitcode.py) знают только первые четыре типа блоков
+MIXES = {'basic': [block for block in BLOCKS if block['Type'] <= BlockType.Health.value],
+         'full': BLOCKS}
+
+
+def synthetic_state(ships: int, map_size: int = 30, seed: int = 0, opponents: int = None,
+                    blocks: list = BLOCKS) -> dict:
+    """
+    Состояние боя с `ships` своими и `opponents` (по умолчанию столько же) чужими кораблями,
+    снаряжение - энергия и пушка из `blocks` плюс три случайных блока оттуда же
+    """
+    rnd = random.Random(seed)
+    opponents = ships if opponents is None else opponents
+
+    def ship(ship_id: int, with_equipment: bool) -> dict:
+        data = {'Id': ship_id,
+                'Position': random_vector(rnd, map_size),
+                'Velocity': '/'.join(str(rnd.randint(-1, 1)) for _ in range(3)),
+                'Health': rnd.randint(1, 100),
+                'Energy': rnd.randint(0, 100)}
+        if with_equipment:
+            data['Equipment'] = blocks[:2] + rnd.sample(blocks[2:], 3)
+        return data
+
+    return {'My': [ship(i, True) for i in range(ships)],
+            'Opponent': [ship(10000 + i, False) for i in range(opponents)],
+            'FireInfos': [{'Source': random_vector(rnd, map_size),
+                           'Target': random_vector(rnd, map_size),
+                           'EffectType': rnd.randint(0, 1)} for _ in range(ships)]}
+
+
+def synthetic_output(state: State) -> UserOutput:
+    """Типичный ответ: каждый корабль двигается к своему оппоненту и стреляет по нему"""
+    user_output = UserOutput(UserCommands=[], Message=f'{len(state.My)} ships')
+    for ship in state.My:
+        target = state.Opponent[ship.Id % len(state.Opponent)]
+        user_output.UserCommands.append(Command(Command=MOVE,
+                                                Parameters=MoveParameters(Id=ship.Id, Target=target.Position)))
+        user_output.UserCommands.append(Command(Command=ATTACK,
+                                                Parameters=AttackParameters(Id=ship.Id,
+                                                                            Name=ship.Equipment[1].Name,
+                                                                            Target=target.Position)))
+    return user_output
+
+
+# endregion
+
+
+# region Reference implementation
+
+
+def reference_block(data):
+    """Разбор блока в том виде, в каком он был до генерации декодеров"""
+    if BlockType(data['Type']) == BlockType.Energy:
+        return EnergyBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Gun:
+        return GunBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Engine:
+        return EngineBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Health:
+        return HealthBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Shield:
+        return ShieldBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Radar:
+        return RadarBlock(**data)
+    elif BlockType(data['Type']) == BlockType.Heal:
+        return HealBlock(**data)
+
+
+def reference_ship(data):
+    if data.get('Equipment'):
+        data['Equipment'] = list(map(reference_block, data.get('Equipment', [])))
+    data['Position'] = Vector.from_json(data['Position'])
+    data['Velocity'] = Vector.from_json(data['Velocity'])
+    return Ship(**data)
+
+
+def reference_fire_info(data):
+    data['Source'] = Vector.from_json(data['Source'])
+    data['Target'] = Vector.from_json(data['Target'])
+    return FireInfo(**data)
+
+
+def reference_state(data):
+    data['My'] = list(map(reference_ship, data['My']))
+    data['Opponent'] = list(map(reference_ship, data['Opponent']))
+    data['FireInfos'] = list(map(reference_fire_info, data['FireInfos']))
+    return State(**data)
+
+
+def reference_encode(result) -> bytes:
+    """Сериализация в том виде, в каком она была до компиляции кодировщиков"""
+    return json.dumps(result, default=JSONCapability.to_json, ensure_ascii=False).encode()
+
+
+# endregion
+
+
+def turns_per_second(function, seconds: float) -> float:
+    """Сколько раз за `seconds` секунд удаётся выполнить `function()`"""
+    turns = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            function()
+        turns += 100
+    return turns / (time.perf_counter() - started)
+
+
+def report(title: str, rows):
+    print(title)
+    print(f'{"ships":>6} {"before, turns/s":>16} {"after, turns/s":>16} {"speedup":>8}')
+    for ships, before, after in rows:
+        print(f'{ships:>6} {before:>16.0f} {after:>16.0f} {after / before:>7.2f}x')
+
+
+def bench_decode(ships_counts, seconds: float):
+    rows = []
+    for ships in ships_counts:
+        line = json.dumps(synthetic_state(ships)).encode()
+        rows.append((ships,
+                     turns_per_second(lambda: reference_state(json.loads(line)), seconds),
+                     turns_per_second(lambda: State.from_json(json.loads(line)), seconds)))
+    report('decode', rows)
+
+
+def bench_encode(ships_counts, seconds: float):
+    rows = []
+    for ships in ships_counts:
+        user_output = synthetic_output(State.from_json(synthetic_state(ships)))
+        rows.append((ships,
+                     turns_per_second(lambda: reference_encode(user_output), seconds),
+                     turns_per_second(lambda: encode(user_output), seconds)))
+    report('encode', rows)
+
+
+# region Strategies
+
+
+# (своих кораблей, чужих кораблей, набор снаряжения, размер карты)
+CASES = [(5, 5, 'basic', 30), (10, 10, 'basic', 30), (20, 5, 'basic', 30), (5, 5, 'full', 30), (10, 10, 'full', 30),
+         (5, 20, 'full', 30), (20, 5, 'full', 30), (50, 50, 'full', 100)]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(ROOT, 'bench_baseline.json')
+
+# замеры в доли миллисекунды шумят сильнее допуска, поэтому меньшее замедление регрессией не считается
+NOISE_FLOOR_MS = 0.05
+
+
+class FunctionalGame:
+    """Обёртка для примеров организаторов, где вместо класса Game функции make_draft и make_turn"""
+
+    def __init__(self, module):
+        self.module = module
+
+    def draft(self, data: dict):
+        return self.module.make_draft(data)
+
+    def battle(self, data: dict):
+        return self.module.make_turn(data)
+
+
+def strategies() -> dict:
+    """Фабрики игр по пути к файлу для algos/ и examples/"""
+    factories = {}
+    for pattern in 'algos/*.py', 'examples/*.py':
+        for path in sorted(os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, pattern))):
+            module = load_module(os.path.join(ROOT, path))
+            if hasattr(module, 'Game'):
+                factories[path] = module.Game
+            elif hasattr(module, 'make_turn'):
+                factories[path] = lambda module=module: FunctionalGame(module)
+    return factories
+
+
+def percentiles(samples: list) -> dict:
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99]) * 1000
+    return {'p50': p50, 'p90': p90, 'p99': p99}
+
+
+def measure(factory, case: tuple, warmup: int, runs: int) -> dict:
+    """Задержки draft (каждый раз на новой игре) и battle (на одной игре после прогрева) в миллисекундах"""
+    my, opponents, mix, map_size = case
+    draft_frame = json.dumps(Engine(map_size=map_size).draft_options(0))
+    frames = [json.dumps(synthetic_state(my, map_size, seed, opponents, MIXES[mix])) for seed in range(8)]
+
+    draft = []
+    for _ in range(runs):
+        game, data = factory(), json.loads(draft_frame)
+        started = time.perf_counter()
+        game.draft(data)
+        draft.append(time.perf_counter() - started)
+
+    battle = []
+    for turn in range(warmup + runs):
+        # стратегии по старому шаблону меняют ввод на месте, поэтому каждый ход разбирается заново
+        data = json.loads(frames[turn % len(frames)])
+        started = time.perf_counter()
+        game.battle(data)
+        if turn >= warmup:
+            battle.append(time.perf_counter() - started)
+
+    return {'draft': percentiles(draft), 'battle': percentiles(battle)}
+
+
+def slower(baseline: dict, result: dict, tolerance: float) -> list:
+    """Стадии, у которых p50 вырос больше допуска и больше порога шума"""
+    flags = []
+    for stage in 'draft', 'battle':
+        previous = baseline.get(stage)
+        current = result[stage]['p50']
+        if previous and current > previous['p50'] * (1 + tolerance) and current - previous['p50'] > NOISE_FLOOR_MS:
+            flags.append(f'{stage} {current / previous["p50"]:.2f}x slower')
+    return flags
+
+
+def bench_strategies(warmup: int, runs: int, tolerance: float, save: bool) -> int:
+    """Печатает таблицу задержек и возвращает число регрессий относительно базового замера"""
+    baseline = {}
+    if os.path.exists(BASELINE) and not save:
+        with open(BASELINE) as file:
+            baseline = json.load(file)
+
+    results, regressions = {}, 0
+    print(f'{"strategy":<22} {"case":<18} {"draft p50":>10} {"battle p50":>11} {"p90":>8} {"p99":>8}  ms')
+    for path, factory in strategies().items():
+        for case in CASES:
+            key = f'{path} {case[0]}x{case[1]} {case[2]} map{case[3]}'
+            name = key[len(path) + 1:]
+            try:
+                result = measure(factory, case, warmup, runs)
+            except Exception:
+                # ошибка сохраняется в базу как ожидаемая; если случай раньше замерялся, это регрессия
+                error = traceback.format_exc().splitlines()[-1]
+                results[key] = {'error': error}
+                failed = 'battle' in baseline.get(key, {})
+                regressions += failed
+                print(f'{path:<22} {name:<18} error: {error}{"  REGRESSION: now fails" if failed else ""}')
+                continue
+            flags = slower(baseline.get(key, {}), result, tolerance)
+            if flags and not save:
+                # на общей машине единичный замер может попасть на чужую нагрузку: регрессия должна повториться
+                repeat = measure(factory, case, warmup, runs)
+                result = {stage: min(result[stage], repeat[stage], key=lambda item: item['p50']) for stage in result}
+                flags = slower(baseline.get(key, {}), result, tolerance)
+            results[key] = result
+            regressions += bool(flags)
+
+            battle = result['battle']
+            print(f'{path:<22} {name:<18} {result["draft"]["p50"]:>10.3f} {battle["p50"]:>11.3f} '
+                  f'{battle["p90"]:>8.3f} {battle["p99"]:>8.3f}  {"REGRESSION: " + ", ".join(flags) if flags else ""}')
+
+    if save:
+        with open(BASELINE, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'baseline saved to {BASELINE}')
+    return regressions
+
+
+# endregion
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('suite', nargs='?', choices=['codec', 'strategies'], default='codec')
+    parser.add_argument('--ships', type=int, nargs='+', default=[5, 10, 50, 200])
+    parser.add_argument('--seconds', type=float, default=1.0)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое замедление p50 относительно базы')
+    parser.add_argument('--save', action='store_true', help='сохранить замер как новый базовый')
+    args = parser.parse_args()
+
+    if args.suite == 'codec':
+        bench_decode(args.ships, args.seconds)
+        bench_encode(args.ships, args.seconds)
+    else:
+        sys.exit(bench_strategies(args.warmup, args.runs, args.tolerance, args.save) > 0)
@@ -0,0 +1,375 @@
+"""
+Локальный движок боя: заменяет сервер соревнования, чтобы гонять стратегии без него
+Запуск: python engine.py algos/final.py algos/simple.py [--turns 300]
+"""
+
+import argparse
+import importlib.util
+import json
+import random
+import sys
+import time
+from typing import List, Optional
+
+from sample import BlockType, EffectType, Physics, Vector
+
+
+# region Catalog
+
+
+BLOCKS = [
+    {'Name': 'small_energy', 'Type': 0, 'IncrementPerTurn': 12, 'MaxEnergy': 100, 'StartEnergy': 100},
+    {'Name': 'big_energy', 'Type': 0, 'IncrementPerTurn': 20, 'MaxEnergy': 200, 'StartEnergy': 150},
+    {'Name': 'blaster', 'Type': 1, 'Damage': 5, 'EnergyPrice': 20, 'Radius': 5, 'EffectType': 0},
+    {'Name': 'railgun', 'Type': 1, 'Damage': 8, 'EnergyPrice': 40, 'Radius': 8, 'EffectType': 1},
+    {'Name': 'small_engine', 'Type': 2, 'MaxAccelerate': 1},
+    {'Name': 'big_engine', 'Type': 2, 'MaxAccelerate': 2},
+    {'Name': 'small_health', 'Type': 3, 'MaxHealth': 100, 'StartHealth': 100},
+    {'Name': 'big_health', 'Type': 3, 'MaxHealth': 160, 'StartHealth': 160},
+    {'Name': 'small_shield', 'Type': 4, 'EnergyPrice': 10, 'Armor': 2},
+    {'Name': 'big_heal', 'Type': 7, 'EnergyPrice': 30, 'Radius': 4, 'HealthGain': 15, 'EnergyGain': 0},
+]
+
+COMPLETE_SHIPS = [
+    {'Id': 'forward', 'Price': 100,
+     'Equipment': ['small_energy', 'blaster', 'small_engine', 'small_health']},
+    {'Id': 'daedalus', 'Price': 140,
+     'Equipment': ['small_energy', 'blaster', 'small_engine', 'small_health', 'big_heal']},
+    {'Id': 'eclipse', 'Price': 180,
+     'Equipment': ['big_energy', 'railgun', 'big_engine', 'big_health', 'small_shield']},
+]
+
+# радаров нет в каталоге по умолчанию: simple.py, targeting.py и shitcode.py не знают такой тип блока,
+# а последние два не знают и щитов с ремонтом, поэтому первый корабль (он же автоматический набор) собран без них
+RADAR = {'Name': 'radar', 'Type': 6, 'EnergyPrice': 10, 'Radius': 8}
+
+
+# endregion
+
+
+class ShipRecord:
+    """Изменяемое состояние корабля внутри движка"""
+    __slots__ = ('Id', 'player', 'position', 'velocity', 'health', 'energy', 'equipment', 'blocks',
+                 'max_health', 'max_energy', 'increment', 'accelerate', 'armor')
+
+    def __init__(self, ship_id: int, player: int, position: Vector, equipment: List[dict]):
+        self.Id = ship_id
+        self.player = player
+        self.position = position
+        self.velocity = Vector(0, 0, 0)
+        self.equipment = equipment
+        self.blocks = {block['Name']: block for block in equipment}
+
+        def total(block_type: BlockType, key: str) -> int:
+            return sum(block[key] for block in equipment if block['Type'] == block_type.value)
+
+        self.max_health = total(BlockType.Health, 'MaxHealth')
+        self.health = total(BlockType.Health, 'StartHealth')
+        self.max_energy = total(BlockType.Energy, 'MaxEnergy')
+        self.energy = total(BlockType.Energy, 'StartEnergy')
+        self.increment = total(BlockType.Energy, 'IncrementPerTurn')
+        self.accelerate = total(BlockType.Engine, 'MaxAccelerate')
+        self.armor = 0
+
+    def to_json(self, with_equipment: bool) -> dict:
+        data = {'Id': self.Id,
+                'Position': str(self.position),
+                'Velocity': str(self.velocity),
+                'Health': self.health,
+                'Energy': self.energy}
+        if with_equipment:
+            data['Equipment'] = self.equipment
+        return data
+
+
+def clamp(value: int, low: int, high: int) -> int:
+    return low if value < low else high if value > high else value
+
+
+def as_dict(result) -> dict:
+    """Ответ стратегии в виде словаря: объекты DraftChoice/UserOutput кодируются средствами модуля стратегии"""
+    if result is None:
+        return {}
+    if isinstance(result, dict):
+        return result
+    module = sys.modules[type(result).__module__]
+    if hasattr(module, 'encode'):
+        return json.loads(module.encode(result))
+    return json.loads(json.dumps(result, default=module.JSONCapability.to_json, ensure_ascii=False))
+
+
+class Engine:
+    """
+    Детерминированный движок боя двух игроков по протоколу соревнования.
+    Порядок хода: команды (DEFEND, SCAN и оплата выстрелов), перемещение, одновременное применение урона
+    и лечения, удаление уничтоженных кораблей, восполнение энергии
+    """
+    PLAYERS = 2
+    ID_SHIFT = 10000
+
+    def __init__(self, map_size: int = 30, money: int = 1000, max_ships: int = 5, max_turns: int = 300,
+                 blocks: List[dict] = None, complete_ships: List[dict] = None, seed: int = None):
+        self.map_size = map_size
+        self.money = money
+        self.max_ships = max_ships
+        self.max_turns = max_turns
+        self.blocks = {block['Name']: block for block in blocks or BLOCKS}
+        self.complete_ships = {ship['Id']: ship for ship in complete_ships or COMPLETE_SHIPS}
+        self.area = max(1, map_size // 3)
+
+        # при заданном seed стартовые места без явной позиции случайны, но одинаковы для обоих игроков (зеркально)
+        cells = [Vector(1 + 2 * index % self.area, 1 + 2 * index // self.area % self.area, 1)
+                 for index in range(max_ships)]
+        if seed is not None:
+            side = range(self.area)
+            cells = random.Random(seed).sample([Vector(x, y, z) for x in side for y in side for z in side], max_ships)
+        self.start_cells = cells
+
+        self.ships: List[ShipRecord] = []
+        self.fire_infos: List[dict] = []
+        self.scanned = [set() for _ in range(self.PLAYERS)]
+        # неразборчивые команды каждого игрока за последний ход
+        self.errors = [[] for _ in range(self.PLAYERS)]
+        self.turn = 0
+
+    # region Draft
+
+    def start_area(self, player: int):
+        if player == 0:
+            return Vector(0, 0, 0), Vector(self.area - 1, self.area - 1, self.area - 1)
+        high = self.map_size - 1
+        return Vector(high - self.area + 1, high - self.area + 1, high - self.area + 1), Vector(high, high, high)
+
+    def draft_options(self, player: int) -> dict:
+        start, end = self.start_area(player)
+        return {'PlayerId': player,
+                'MapSize': self.map_size,
+                'Money': self.money,
+                'MaxShipsCount': self.max_ships,
+                'DraftTimeout': 1000,
+                'BattleRoundTimeout': 100,
+                'StartArea': {'From': str(start), 'To': str(end)},
+                'Equipment': [{'Size': 1, 'Equipment': block} for block in self.blocks.values()],
+                'CompleteShips': list(self.complete_ships.values())}
+
+    def default_position(self, player: int, index: int) -> Vector:
+        start, end = self.start_area(player)
+        shift = self.start_cells[index % len(self.start_cells)]
+        return start + shift if player == 0 else end - shift
+
+    def draft(self, choices: list) -> None:
+        """
+        Набор кораблей по ответам игроков; лишние по деньгам или количеству корабли отбрасываются,
+        неразборчивые - тоже, с записью в `errors` игрока
+        """
+        for player, choice in enumerate(choices):
+            try:
+                ships = list(as_dict(choice).get('Ships') or ())
+            except (AttributeError, TypeError, ValueError) as error:
+                self.errors[player].append(f'bad draft: {error!r}')
+                ships = None
+            if not ships:
+                # пустой ответ - корабли набираются автоматически
+                ships = [{'CompleteShipId': next(iter(self.complete_ships))}] * self.max_ships
+
+            money = self.money
+            start, end = self.start_area(player)
+            for ship in ships[:self.max_ships]:
+                try:
+                    complete_ship = self.complete_ships.get(ship.get('CompleteShipId'))
+                    position = ship.get('Position')
+                    if position is not None:
+                        position = Vector.from_json(str(position))
+                except (AttributeError, TypeError, ValueError) as error:
+                    self.errors[player].append(f'bad draft ship {ship!r}: {error!r}')
+                    continue
+                if complete_ship is None or complete_ship['Price'] > money:
+                    continue
+                money -= complete_ship['Price']
+
+                index = sum(record.player == player for record in self.ships)
+                if position is None or not all(low <= value <= high
+                                               for low, value, high in zip(start, position, end)):
+                    position = self.default_position(player, index)
+
+                equipment = [self.blocks[name] for name in complete_ship['Equipment']]
+                self.ships.append(ShipRecord(player * self.ID_SHIFT + index, player, position, equipment))
+
+    # endregion
+
+    # region Battle
+
+    def state(self, player: int) -> dict:
+        """Ввод хода для игрока `player` в формате сервера (стратегии по старому шаблону меняют словари на месте)"""
+        scanned = self.scanned[player]
+        return {'My': [ship.to_json(True) for ship in self.ships if ship.player == player],
+                'Opponent': [ship.to_json(ship.Id in scanned) for ship in self.ships if ship.player != player],
+                'FireInfos': [dict(fire_info) for fire_info in self.fire_infos]}
+
+    @property
+    def finished(self) -> bool:
+        players = {ship.player for ship in self.ships}
+        return len(players) < self.PLAYERS or self.turn >= self.max_turns
+
+    @property
+    def winner(self) -> Optional[int]:
+        """Номер победителя, None - ничья. После лимита ходов побеждает сторона с большим суммарным здоровьем"""
+        health = [sum(ship.health for ship in self.ships if ship.player == player) for player in range(self.PLAYERS)]
+        if health[0] == health[1]:
+            return None
+        return int(health[1] > health[0])
+
+    def step(self, outputs: list) -> None:
+        """
+        Применяет ответы обоих игроков и переводит бой на следующий ход.
+        Неразборчивые команды отбрасываются и попадают в `errors` игрока, чтобы вызывающий мог их засчитать
+        """
+        by_id = {ship.Id: ship for ship in self.ships}
+        moves = {}
+        shots = []
+        self.fire_infos = []
+        self.scanned = [set() for _ in range(self.PLAYERS)]
+        for ship in self.ships:
+            ship.armor = 0
+
+        self.errors = [[] for _ in range(self.PLAYERS)]
+        for player, output in enumerate(outputs):
+            try:
+                commands = list(as_dict(output).get('UserCommands') or ())
+            except (AttributeError, TypeError, ValueError) as error:
+                self.errors[player].append(f'bad output: {error!r}')
+                continue
+            for command in commands:
+                # ответ бота не должен ронять движок: неразборчивая команда отбрасывается и записывается игроку
+                try:
+                    self.apply(player, command, by_id, moves, shots)
+                except (AttributeError, KeyError, TypeError, ValueError) as error:
+                    self.errors[player].append(f'bad command {command!r}: {error!r}')
+
+        for ship_id, (name, vector) in moves.items():
+            self.move(by_id[ship_id], name, vector)
+
+        self.resolve(shots)
+
+        self.ships = [ship for ship in self.ships if ship.health > 0]
+        for ship in self.ships:
+            ship.energy = min(ship.max_energy, ship.energy + ship.increment)
+        self.turn += 1
+
+    def apply(self, player: int, command: dict, by_id: dict, moves: dict, shots: list) -> None:
+        """
+        Одна команда игрока: перемещения и выстрелы откладываются в `moves` и `shots`, остальное применяется сразу.
+        Команды чужим или несуществующим кораблям пропускаются, а неразборчивые поднимают исключение
+        до изменения состояния
+        """
+        parameters = command['Parameters']
+        ship = by_id.get(parameters['Id'])
+        if ship is None or ship.player != player:
+            return
+        name = command['Command']
+        if name == 'MOVE' or name == 'ACCELERATE':
+            moves[ship.Id] = name, Vector.from_json(parameters.get('Target') or parameters.get('Vector'))
+            return
+
+        block = ship.blocks.get(parameters.get('Name'))
+        if block is None or ship.energy < block.get('EnergyPrice', 0):
+            return
+        if name == 'ATTACK' and block['Type'] in (BlockType.Gun.value, BlockType.Heal.value):
+            target = Vector.from_json(parameters['Target'])
+            if Physics.clen(target - ship.position) <= block['Radius']:
+                ship.energy -= block['EnergyPrice']
+                shots.append((ship, block, target))
+        elif name == 'DEFEND' and block['Type'] == BlockType.Shield.value:
+            ship.energy -= block['EnergyPrice']
+            ship.armor = block['Armor']
+        elif name == 'SCAN' and block['Type'] == BlockType.Radar.value:
+            ship.energy -= block['EnergyPrice']
+            self.scanned[player].update(other.Id for other in self.ships
+                                        if other.player != player and
+                                        Physics.clen(other.position - ship.position) <= block['Radius'])
+
+    def move(self, ship: ShipRecord, name: str, vector: Vector) -> None:
+        limit = ship.accelerate
+        if name == 'MOVE':
+            # ускорение, гасящее текущую скорость и ведущее к цели
+            vector = vector - ship.position - ship.velocity
+        acceleration = Vector(clamp(vector.x, -limit, limit), clamp(vector.y, -limit, limit),
+                              clamp(vector.z, -limit, limit))
+        velocity = ship.velocity + acceleration
+        position = ship.position + velocity
+
+        high = self.map_size - 1
+        # у стены скорость по этой оси гасится
+        ship.position = Vector(clamp(position.x, 0, high), clamp(position.y, 0, high), clamp(position.z, 0, high))
+        ship.velocity = Vector(*(0 if clamped != free else speed
+                                 for clamped, free, speed in zip(ship.position, position, velocity)))
+
+    def resolve(self, shots: list) -> None:
+        """Урон и лечение считаются по позициям после перемещения и применяются одновременно"""
+        by_cell = {}
+        for ship in self.ships:
+            by_cell.setdefault(ship.position, []).append(ship)
+
+        damage = {}
+        for source, block, target in shots:
+            if block['Type'] == BlockType.Heal.value:
+                for ship in by_cell.get(target, ()):
+                    ship.health = min(ship.max_health, ship.health + block['HealthGain'])
+                    ship.energy = min(ship.max_energy, ship.energy + block['EnergyGain'])
+                continue
+
+            self.fire_infos.append({'Source': str(source.position), 'Target': str(target),
+                                    'EffectType': block['EffectType']})
+            if block['EffectType'] == EffectType.Railgun.value:
+                cells = Physics.bresenham_ray(source.position, target, block['Radius'] + 1)[1:]
+            else:
+                cells = [target]
+            for cell in cells:
+                for ship in by_cell.get(cell, ()):
+                    damage[ship] = damage.get(ship, 0) + max(0, block['Damage'] - ship.armor)
+
+        for ship, value in damage.items():
+            ship.health -= value
+
+    # endregion
+
+
+def play(games: list, engine: Engine = None) -> Optional[int]:
+    """Бой стратегий (объектов с методами draft и battle) внутри одного процесса"""
+    engine = engine or Engine()
+    engine.draft([game.draft(engine.draft_options(player)) for player, game in enumerate(games)])
+    while not engine.finished:
+        engine.step([game.battle(engine.state(player)) for player, game in enumerate(games)])
+    return engine.winner
+
+
+def load_module(path: str):
+    """Модуль стратегии по пути к файлу, каждый файл загружается один раз"""
+    name = path.replace('/', '_').replace('.', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_game(path: str):
+    """Класс Game из файла стратегии"""
+    return load_module(path).Game
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('bots', nargs=2)
+    parser.add_argument('--turns', type=int, default=300)
+    args = parser.parse_args()
+
+    engine = Engine(max_turns=args.turns)
+    started = time.perf_counter()
+    winner = play([load_game(path)() for path in args.bots], engine)
+    elapsed = time.perf_counter() - started
+
+    print(f'winner: {"draw" if winner is None else args.bots[winner]}, turns: {engine.turn}, '
+          f'{engine.turn / elapsed:.0f} turns/s')
@@ -0,0 +1,41 @@
+"""
+Сборка файла геометрических таблиц (см. `Geometry` в sample.py), который боты отображают в память при старте
+Запуск: python geometry.py [--radius 8] [--out geometry.bin]
+"""
+
+import argparse
+import os
+import time
+
+from engine import BLOCKS, RADAR
+from sample import Geometry, TableFile
+
+# наибольший радиус в каталоге движка, чтобы таблиц хватило любому драфту
+CATALOG_RADIUS = max(block.get('Radius', 0) for block in BLOCKS + [RADAR])
+
+
+def ensure(radius: int = CATALOG_RADIUS, path: str = Geometry.PATH) -> None:
+    """Собирает файл, если его нет или его радиус меньше нужного"""
+    try:
+        if len(TableFile.load(path)['cells']) >= (2 * radius + 1) ** 3:
+            return
+    except (OSError, ValueError, KeyError):
+        pass
+    TableFile.save(path, Geometry.build(radius))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--radius', type=int, default=CATALOG_RADIUS)
+    parser.add_argument('--out', default=Geometry.PATH)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    TableFile.save(args.out, Geometry.build(args.radius))
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    Geometry().prepare(args.radius, args.out)
+    loaded = time.perf_counter() - started
+    print(f'{args.out}: radius {args.radius}, {os.path.getsize(args.out) / 2 ** 20:.1f} MiB, '
+          f'built in {built * 1000:.0f} ms, loaded in {loaded * 1000:.2f} ms')
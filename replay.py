@@ -0,0 +1,54 @@
+"""
+Повтор записанного матча (см. `Recorder` в sample.py) на любой стратегии без сервера
+Запуск: python replay.py match.rec.gz algos/final.py [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from engine import as_dict, load_game
+from sample import read_recording
+
+
+def replay(path: str, game_class, repeat: int = 1) -> dict:
+    """
+    Прогон записи через `game_class`: время каждого вызова battle и число ходов,
+    на которых ответ стратегии отличается от записанного
+    """
+    events = list(read_recording(path))
+    latencies, mismatches, turns = [], 0, 0
+    for _ in range(repeat):
+        game = game_class()
+        answer = None
+        for kind, data in events:
+            # стратегии по старому шаблону меняют словари на месте, поэтому каждый раз отдаётся копия
+            data = json.loads(json.dumps(data))
+            if kind == 'draft':
+                answer = as_dict(game.draft(data))
+            elif kind == 'battle':
+                started = time.perf_counter()
+                result = game.battle(data)
+                latencies.append(time.perf_counter() - started)
+                answer = as_dict(result)
+                turns += 1
+            elif answer is not None:
+                mismatches += answer != data
+                answer = None
+
+    return {'turns': turns, 'mismatches': mismatches, 'latencies': latencies}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recording')
+    parser.add_argument('bot')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    result = replay(args.recording, load_game(args.bot), args.repeat)
+    p50, p90, p99 = np.percentile(result['latencies'], [50, 90, 99]) * 1000 if result['latencies'] else [0] * 3
+    print(f'turns: {result["turns"]}, answers differing from the recording: {result["mismatches"]}, '
+          f'battle p50/p90/p99: {p50:.3f}/{p90:.3f}/{p99:.3f} ms')
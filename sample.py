@@ -3,71 +3,116 @@
 Прошу, не добавляйте сюда никакой логики поведения, иначе я обижусь
 """
 
+import gzip
 import json
-from dataclasses import dataclass
+import mmap
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import MISSING, dataclass, fields
 from enum import Enum
-from typing import List
+from json.encoder import encode_basestring
+from queue import Queue
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
 
 
 # region Primitives
 
 
-@dataclass
-class Vector:
+class Vector(NamedTuple):
+    """
+    Неизменяемый вектор поверх кортежа: хешируется, сравнивается покоординатно,
+    а вместо изменения на месте создаётся новый вектор (`v._replace(x=...)`, арифметика)
+    """
     x: int
     y: int
     z: int
 
     def __add__(self, other):
-        if not isinstance(other, Vector):
-            raise TypeError()
-        return Vector(self.x + other.x,
-                      self.y + other.y,
-                      self.z + other.z)
+        return Vector(self[0] + other[0],
+                      self[1] + other[1],
+                      self[2] + other[2])
 
     def __sub__(self, other):
-        if not isinstance(other, Vector):
-            raise TypeError()
-        return Vector(self.x - other.x,
-                      self.y - other.y,
-                      self.z - other.z)
-
-    def __mul__(self, other):
-        if not isinstance(other, int):
-            raise TypeError()
-        return Vector(self.x * other,
-                      self.y * other,
-                      self.z * other)
-
-    def __str__(self):
-        return f'{self.x}/{self.y}/{self.z}'
-
-    def __eq__(self, other):
-        return self.coords == other.coords
+        return Vector(self[0] - other[0],
+                      self[1] - other[1],
+                      self[2] - other[2])
 
-    def __ne__(self, other):
-        return self.coords != other.coords
+    def __mul__(self, other: int):
+        return Vector(self[0] * other,
+                      self[1] * other,
+                      self[2] * other)
 
-    def __gt__(self, other):
-        return self.coords > other.coords
+    __rmul__ = __mul__
 
-    def __lt__(self, other):
-        return self.coords < other.coords
+    def __neg__(self):
+        return Vector(-self[0], -self[1], -self[2])
 
-    def __ge__(self, other):
-        return self.coords >= other.coords
+    def __abs__(self):
+        """Покоординатный модуль"""
+        return Vector(abs(self[0]), abs(self[1]), abs(self[2]))
 
-    def __le__(self, other):
-        return self.coords <= other.coords
+    def __str__(self):
+        text = VECTORS.formatted.get(self)
+        if text is None:
+            text = VECTORS.format(self)
+        return text
 
     @property
     def coords(self):
-        return self.x, self.y, self.z
+        return tuple(self)
 
     @classmethod
     def from_json(cls, data: str):
+        vector = VECTORS.parsed.get(data)
+        if vector is None:
+            vector = VECTORS.parse(data)
+        return vector
+
+
+class VectorCache:
+    """
+    Интернирование векторов: одинаковые строки 'x/y/z' разбираются один раз и дают общий неизменяемый Vector,
+    обратная таблица хранит готовые строки для `Vector.__str__`. При переполнении вытесняются самые старые записи
+    """
+    MAX_SIZE = 1 << 16
+
+    def __init__(self, size: int = 30 ** 3):
+        self.size = size
+        # OrderedDict: вытеснение с начала обычного dict просматривает накопившиеся удалённые слоты и стоит O(n)
+        self.parsed = OrderedDict()
+        self.formatted = OrderedDict()
+
+    def resize(self, map_size: int) -> None:
+        """Размер кэша по числу клеток карты (`DraftOptions.MapSize` в кубе)"""
+        self.size = min(map_size ** 3, self.MAX_SIZE)
+        for table in self.parsed, self.formatted:
+            while len(table) > self.size:
+                table.popitem(last=False)
+
+    def parse(self, data: str) -> Vector:
         x, y, z = map(int, data.split('/'))
-        return cls(x, y, z)
+        vector = Vector(x, y, z)
+        self.store(self.parsed, data, vector)
+        return vector
+
+    def format(self, vector: Vector) -> str:
+        text = f'{vector[0]}/{vector[1]}/{vector[2]}'
+        self.store(self.formatted, vector, text)
+        return text
+
+    def store(self, table: OrderedDict, key, value) -> None:
+        if len(table) >= self.size:
+            table.popitem(last=False)
+        table[key] = value
+
+
+VECTORS = VectorCache()
 
 
 # endregion
@@ -82,85 +127,578 @@ class JSONCapability:
                 for k, v in self.__dict__.items() if v is not None}
 
 
+# ведомые оси для каждой ведущей оси луча
+PLANE_AXES = ((1, 2), (0, 2), (1, 0))
+
+
 class Physics:
     @staticmethod
     def clen(v: Vector) -> int:
         """Метрика Чебышёва"""
-        return max(map(abs, v.coords))
+        x, y, z = v
+        return max(abs(x), abs(y), abs(z))
 
     @staticmethod
     def mlen(v: Vector) -> int:
         """Манхэттенская метрика"""
-        return sum(map(abs, v.coords))
+        x, y, z = v
+        return abs(x) + abs(y) + abs(z)
 
     @staticmethod
     def get_len_vector(vector_diff: Vector) -> int:
         """Метод для нахождения длины разности векторов"""
 
-        return sum(value ** 2 for value in vector_diff.coords) ** 0.5
+        x, y, z = vector_diff
+        return (x * x + y * y + z * z) ** 0.5
+
+    @staticmethod
+    def as_points(points) -> np.ndarray:
+        """Массив (N, 3) из массива NumPy или списка векторов"""
+        return np.asarray(points, dtype=np.int64).reshape(-1, 3)
+
+    @staticmethod
+    def pairwise(a, b, metric: str = 'euclidean') -> np.ndarray:
+        """
+        Матрица расстояний (len(a), len(b)) между двумя наборами точек.
+        Метрики: 'chebyshev' (как clen), 'manhattan' (как mlen), 'euclidean' (как get_len_vector)
+        и 'sqeuclidean' - квадрат евклидова расстояния, для сравнений без извлечения корня
+        """
+        delta = Physics.as_points(a)[:, None, :] - Physics.as_points(b)[None, :, :]
+
+        if metric == 'chebyshev':
+            return np.abs(delta).max(axis=2, initial=0)
+        elif metric == 'manhattan':
+            return np.abs(delta).sum(axis=2)
+        elif metric == 'sqeuclidean':
+            return (delta * delta).sum(axis=2)
+        elif metric == 'euclidean':
+            return np.sqrt((delta * delta).sum(axis=2))
+        raise ValueError(f'unknown metric: {metric}')
+
+    @staticmethod
+    def closest(a, b, metric: str = 'sqeuclidean') -> np.ndarray:
+        """Для каждой точки из `a` индекс ближайшей точки из `b` (при равенстве - первой, как у min)"""
+        return Physics.pairwise(a, b, metric).argmin(axis=1)
+
+    @staticmethod
+    def by_distance(a, b, metric: str = 'sqeuclidean') -> np.ndarray:
+        """Для каждой точки из `a` индексы точек из `b` по возрастанию расстояния"""
+        return Physics.pairwise(a, b, metric).argsort(axis=1, kind='stable')
+
+    @staticmethod
+    def bresenham_points(point1: Vector, point2: Vector, length: int = None,
+                         stop: Callable[[Vector], bool] = None) -> Iterator[Vector]:
+        """
+        Ленивый вариант луча Брезенхама (https://clck.ru/Vbigh): точки выдаются по одной, начиная с `point1`.
+        Луч обрывается после `length` точек или на первой точке после начальной, для которой `stop(point)` истинно
+        (сама эта точка ещё выдаётся, например первая занятая клетка)
+        """
+        start = tuple(point1)
+        delta = [b - a for a, b in zip(start, point2)]
+        shifts = [abs(d) for d in delta]
+        steps = [(d > 0) - (d < 0) for d in delta]
+
+        # ведущая ось - с наибольшим смещением, при равенстве x, затем y
+        lead = shifts.index(max(shifts))
+        side1, side2 = PLANE_AXES[lead]
+
+        yield Vector(*start)
+        count = shifts[lead] if not length else min(shifts[lead], length - 1)
+
+        point = list(start)
+        lead_shift, lead_step = shifts[lead], steps[lead]
+        shift1, step1 = shifts[side1], steps[side1]
+        shift2, step2 = shifts[side2], steps[side2]
+        # p1, p2 - накопленное смещение по ведомым осям
+        p1 = 2 * shift1 - lead_shift
+        p2 = 2 * shift2 - lead_shift
+        for _ in range(count):
+            point[lead] += lead_step
+            if p1 >= 0:
+                point[side1] += step1
+                p1 -= 2 * lead_shift
+            if p2 >= 0:
+                point[side2] += step2
+                p2 -= 2 * lead_shift
+            p1 += 2 * shift1
+            p2 += 2 * shift2
+
+            vector = Vector(*point)
+            yield vector
+            if stop is not None and stop(vector):
+                return
 
     @staticmethod
     def bresenham_ray(point1: Vector, point2: Vector, length: int = None) -> List[Vector]:
         """Метод для построение вектора по алгоритмы Брезенхама (https://clck.ru/Vbigh)"""
+        ray = RAYS.ray(point1, point2, length)
+        if ray is None:
+            ray = list(Physics.bresenham_points(point1, point2, length))
+        return ray
+
+    @staticmethod
+    def bresenham_rays(sources, targets, length: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетный луч Брезенхама для пар `sources[i]` -> `targets[i]`.
+        Возвращает массив точек (M, L, 3) и число точек каждого луча (M,);
+        короткие лучи дополнены повторением своей последней точки
+        """
+        sources, targets = Physics.as_points(sources), Physics.as_points(targets)
+        if RAYS.covers(targets - sources):
+            return RAYS.batch(sources, targets, length)
+        return Physics.trace_rays(sources, targets, length)
+
+    @staticmethod
+    def trace_rays(sources: np.ndarray, targets: np.ndarray, length: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Пошаговое построение лучей для `bresenham_rays` без таблицы `RAYS`"""
+        current = sources.copy()
+        delta = targets - current
+        shifts = np.abs(delta)
+        steps = np.sign(delta)
+
+        rows = np.arange(len(current))
+        lead = shifts.argmax(axis=1)
+        sides = np.array(PLANE_AXES)[lead]
+        lead_shift = shifts[rows, lead]
+        lead_step = steps[rows, lead]
+        side_shifts = np.take_along_axis(shifts, sides, axis=1)
+        side_steps = np.take_along_axis(steps, sides, axis=1)
+
+        counts = lead_shift if not length else np.minimum(lead_shift, length - 1)
+        points = np.empty((len(current), counts.max(initial=0) + 1, 3), dtype=np.int64)
+        points[:, 0] = current
+
+        p = 2 * side_shifts - lead_shift[:, None]
+        for t in range(1, points.shape[1]):
+            active = counts >= t
+            current[rows, lead] += lead_step * active
+            moved = (p >= 0) & active[:, None]
+            current[rows[:, None], sides] += side_steps * moved
+            p -= 2 * lead_shift[:, None] * moved
+            p += 2 * side_shifts * active[:, None]
+            points[:, t] = current
+
+        return points, counts + 1
+
+
+class RayTable:
+    """
+    Лучи Брезенхама зависят только от разности `point2 - point1`, поэтому для всех разностей
+    в кубе [-radius, radius]^3 они считаются один раз (во время драфта или заранее, см. `Geometry`)
+    и хранятся как смещения от начала луча.
+    `offsets[i]` - точки i-го луча, дополненные повторением последней, `lengths[i]` - их число
+    """
+
+    def __init__(self):
+        self.radius = -1
+        self.offsets = np.zeros((0, 1, 3), dtype=np.int16)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.rays = {}
+
+    @staticmethod
+    def trace(radius: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Смещения и длины лучей для всех разностей куба в порядке `index`"""
+        side = np.arange(-radius, radius + 1)
+        deltas = np.stack(np.meshgrid(side, side, side, indexing='ij'), axis=-1).reshape(-1, 3)
+        offsets, lengths = Physics.trace_rays(np.zeros_like(deltas), deltas)
+        return offsets.astype(np.int16), lengths
+
+    def build(self, radius: int) -> None:
+        self.attach(*self.trace(radius))
+
+    def attach(self, offsets: np.ndarray, lengths: np.ndarray) -> None:
+        """Готовые таблицы, например отображённые в память из файла"""
+        self.radius = (round(len(lengths) ** (1 / 3)) - 1) // 2
+        self.offsets = offsets
+        self.lengths = lengths
+        # лучи в виде кортежей, чтобы одиночный луч не трогал NumPy; заполняются по мере обращения
+        self.rays = {}
+
+    def index(self, dx: int, dy: int, dz: int) -> int:
+        side = 2 * self.radius + 1
+        return ((dx + self.radius) * side + dy + self.radius) * side + dz + self.radius
+
+    def covers(self, delta) -> bool:
+        return np.abs(delta).max(initial=0) <= self.radius
+
+    def ray(self, point1: Vector, point2: Vector, length: int = None) -> List[Vector]:
+        """Луч как у `Physics.bresenham_ray`, или None, если разность точек не попала в таблицу"""
+        x, y, z = point1
+        dx, dy, dz = point2[0] - x, point2[1] - y, point2[2] - z
+        if max(abs(dx), abs(dy), abs(dz)) > self.radius:
+            return None
+        index = self.index(dx, dy, dz)
+        offsets = self.rays.get(index)
+        if offsets is None:
+            offsets = self.rays[index] = tuple(map(tuple, self.offsets[index, :self.lengths[index]].tolist()))
+        return [Vector(x + ox, y + oy, z + oz) for ox, oy, oz in offsets[:length or None]]
+
+    def batch(self, sources: np.ndarray, targets: np.ndarray, length: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Пакетный вариант `ray` для разностей, покрытых таблицей (см. `Physics.bresenham_rays`)"""
+        delta = targets - sources
+        indices = self.index(delta[:, 0], delta[:, 1], delta[:, 2])
+        counts = self.lengths[indices] if not length else np.minimum(self.lengths[indices], length)
+
+        columns = np.minimum(np.arange(counts.max(initial=1))[None, :], counts[:, None] - 1)
+        return self.offsets[indices[:, None], columns] + sources[:, None, :], counts
+
+
+RAYS = RayTable()
+
+
+class TableFile:
+    """
+    Именованные массивы NumPy в одном двоичном файле: сигнатура, строка-заголовок JSON
+    {имя: [dtype, shape, смещение]} и данные, выровненные по 64 байта.
+    `load` отображает файл в память только для чтения: массивы - представления без копирования,
+    а процессы, открывшие один файл, делят его страницы
+    """
+    MAGIC = b'TABLES1 '
+    ALIGN = 64
+
+    @classmethod
+    def aligned(cls, size: int) -> int:
+        return -(-size // cls.ALIGN) * cls.ALIGN
+
+    @classmethod
+    def save(cls, path: str, arrays: Dict[str, np.ndarray]) -> None:
+        arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        header, offset = {}, 0
+        for name, array in arrays.items():
+            header[name] = [array.dtype.str, list(array.shape), offset]
+            offset += cls.aligned(array.nbytes)
+        head = cls.MAGIC + json.dumps(header).encode() + b'\n'
+        head += b' ' * (cls.aligned(len(head)) - len(head))
+
+        # запись во временный файл и переименование: запущенные боты продолжают читать старую версию
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(head)
+            for array in arrays.values():
+                file.write(array.tobytes())
+                file.write(bytes(cls.aligned(array.nbytes) - array.nbytes))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> Dict[str, np.ndarray]:
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError(f'{path} is not a table file')
+
+        end = buffer.find(b'\n')
+        header = json.loads(buffer[len(cls.MAGIC):end])
+        start = cls.aligned(end + 1)
+        arrays = {}
+        for name, (dtype, shape, offset) in header.items():
+            count = int(np.prod(shape))
+            array = np.frombuffer(buffer, dtype, count, start + offset) if count else np.empty(0, dtype)
+            arrays[name] = array.reshape(shape)
+        return arrays
+
+
+class Geometry:
+    """
+    Таблицы, которые зависят только от радиусов снаряжения:
+    лучи Брезенхама (`RAYS`) и смещения клеток куба [-radius, radius]^3, упорядоченные по метрике Чебышёва,
+    а при равенстве - по евклидову расстоянию, так что клетки в пределах радиуса r - это первые (2r + 1)^3 строк.
+    Таблицы заранее собираются в файл (python geometry.py) и при старте отображаются в память;
+    если файла нет или его радиуса не хватает, они строятся на месте
+    """
+    PATH = os.environ.get('GEOMETRY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geometry.bin'))
+
+    def __init__(self):
+        self.radius = -1
+        self.offsets = np.zeros((0, 3), dtype=np.int16)
+
+    @staticmethod
+    def build(radius: int) -> Dict[str, np.ndarray]:
+        side = np.arange(-radius, radius + 1)
+        cells = np.stack(np.meshgrid(side, side, side, indexing='ij'), axis=-1).reshape(-1, 3)
+        order = np.lexsort(((cells * cells).sum(axis=1), np.abs(cells).max(axis=1)))
+        ray_offsets, ray_lengths = RayTable.trace(radius)
+        return {'cells': cells[order].astype(np.int16), 'ray_offsets': ray_offsets, 'ray_lengths': ray_lengths}
+
+    def prepare(self, radius: int, path: str = None) -> None:
+        """Таблицы радиуса не меньше `radius`: из файла, если он подходит, иначе построенные заново"""
+        if self.radius >= radius:
+            return
+        path = path or self.PATH
+        try:
+            arrays = TableFile.load(path)
+        except (OSError, ValueError):
+            arrays = None
+        if arrays is None or len(arrays['cells']) < (2 * radius + 1) ** 3:
+            arrays = self.build(radius)
+
+        self.offsets = arrays['cells']
+        self.radius = (round(len(self.offsets) ** (1 / 3)) - 1) // 2
+        RAYS.attach(arrays['ray_offsets'], arrays['ray_lengths'])
+
+    def cells(self, center: Vector, radius: int) -> np.ndarray:
+        """Клетки (N, 3) в пределах `radius` по метрике Чебышёва от `center`, от ближних к дальним"""
+        return self.offsets[:(2 * radius + 1) ** 3] + np.asarray(center, dtype=np.int64)
+
+
+GEOMETRY = Geometry()
+
+
+class SpatialGrid:
+    """
+    Равномерная сетка для запросов по положению кораблей: точки раскладываются по ячейкам со стороной `cell`,
+    и запрос просматривает только ячейки, которые пересекает его куб, а не все корабли.
+    Точки задаются индексами в исходном массиве `points`; метрики те же, что у `Physics.pairwise`
+    ('chebyshev' как clen, 'manhattan' как mlen, 'euclidean' как get_len_vector, 'sqeuclidean').
+    При равных расстояниях раньше идёт меньший индекс, как у `Physics.by_distance`
+    """
+
+    def __init__(self, points, cell: int = 4):
+        self.cell = cell
+        self.rebuild(points)
+
+    def rebuild(self, points) -> None:
+        self.points = Physics.as_points(points).copy()
+        self.buckets = {}
+        for index, key in enumerate(map(tuple, (self.points // self.cell).tolist())):
+            self.buckets.setdefault(key, []).append(index)
+        self.low = self.points.min(axis=0, initial=0) // self.cell
+        self.high = self.points.max(axis=0, initial=0) // self.cell
+
+    def move(self, index: int, point: Vector) -> None:
+        """Новое положение одной точки без перестройки всей сетки"""
+        old = tuple((self.points[index] // self.cell).tolist())
+        self.points[index] = point
+        new = tuple((self.points[index] // self.cell).tolist())
+        if old != new:
+            bucket = self.buckets[old]
+            bucket.remove(index)
+            if not bucket:
+                del self.buckets[old]
+            self.buckets.setdefault(new, []).append(index)
+            self.low = np.minimum(self.low, self.points[index] // self.cell)
+            self.high = np.maximum(self.high, self.points[index] // self.cell)
+
+    def candidates(self, low, high) -> List[int]:
+        """Индексы точек из ячеек с координатами от `low` до `high` включительно"""
+        return self.shell(low, high, None, None)
+
+    def shell(self, low, high, inner_low, inner_high) -> List[int]:
+        """Как `candidates`, но без ячеек внутреннего куба от `inner_low` до `inner_high` (если он задан)"""
+        (lx, ly, lz), (hx, hy, hz) = np.maximum(low, self.low).tolist(), np.minimum(high, self.high).tolist()
+        if lx > hx or ly > hy or lz > hz:
+            return []
+        inner = None if inner_low is None else (*inner_low, *inner_high)
+        found = []
+        # перебор ячеек куба или, если он больше, непустых ячеек
+        if (hx - lx + 1) * (hy - ly + 1) * (hz - lz + 1) <= len(self.buckets):
+            get = self.buckets.get
+            for x in range(lx, hx + 1):
+                for y in range(ly, hy + 1):
+                    if inner and inner[0] <= x <= inner[3] and inner[1] <= y <= inner[4]:
+                        # внутри проекции внутреннего куба нужны только ячейки за его пределами по z
+                        zs = [*range(lz, min(hz, inner[2] - 1) + 1), *range(max(lz, inner[5] + 1), hz + 1)]
+                    else:
+                        zs = range(lz, hz + 1)
+                    for z in zs:
+                        bucket = get((x, y, z))
+                        if bucket:
+                            found.extend(bucket)
+        else:
+            for (x, y, z), bucket in self.buckets.items():
+                if lx <= x <= hx and ly <= y <= hy and lz <= z <= hz and not (
+                        inner and inner[0] <= x <= inner[3] and inner[1] <= y <= inner[4] and inner[2] <= z <= inner[5]):
+                    found.extend(bucket)
+        return found
+
+    def distances(self, center: Vector, indices: np.ndarray, metric: str) -> np.ndarray:
+        return Physics.pairwise([center], self.points[indices], metric)[0]
+
+    def within(self, center: Vector, radius: float, metric: str = 'chebyshev') -> np.ndarray:
+        """Индексы точек на расстоянии не больше `radius` от `center`, по возрастанию индекса"""
+        center = np.asarray(center, dtype=np.int64)
+        reach = int(radius)
+        indices = np.array(sorted(self.candidates((center - reach) // self.cell, (center + reach) // self.cell)),
+                           dtype=np.int64)
+        if metric == 'sqeuclidean':
+            radius = radius * radius
+        return indices[self.distances(center, indices, metric) <= radius]
+
+    def nearest(self, center: Vector, k: int = 1, metric: str = 'euclidean') -> np.ndarray:
+        """
+        Индексы `k` ближайших к `center` точек по возрастанию расстояния.
+        Ячейки просматриваются слоями вокруг ячейки центра, пока k-е найденное расстояние
+        не станет меньше расстояния по Чебышёву до непросмотренной области (любая метрика не меньше его)
+        """
+        center = np.asarray(center, dtype=np.int64)
+        home = (center // self.cell).tolist()
+        k = min(k, len(self.points))
+        if not k:
+            return np.zeros(0, dtype=np.int64)
+
+        found, layer, inner = [], 0, (None, None)
+        while True:
+            low, high = [c - layer for c in home], [c + layer for c in home]
+            found.extend(self.shell(low, high, *inner))
+            inner = (low, high)
+            covered = (np.asarray(low) <= self.low).all() and (np.asarray(high) >= self.high).all()
+            if len(found) >= k or covered:
+                indices = np.array(found, dtype=np.int64)
+                distances = self.distances(center, indices, metric)
+                order = np.lexsort((indices, distances))[:k]
+                bound = min((center - np.asarray(low) * self.cell + 1).min(),
+                            ((np.asarray(high) + 1) * self.cell - center).min())
+                if metric == 'sqeuclidean':
+                    bound = bound * bound
+                if covered or distances[order[-1]] < bound:
+                    return indices[order]
+            layer += 1
+
+
+# endregion
+
+
+# region Transport
+
+
+class Transport(ABC):
+    """Канал обмена с сервером: один кадр - одна строка JSON в виде bytes"""
+
+    @abstractmethod
+    def read(self) -> bytes:
+        """Следующий кадр; EOFError, когда кадров больше не будет"""
+
+    @abstractmethod
+    def write(self, frame: bytes) -> None:
+        """Отправка кадра"""
+
+
+class StdioTransport(Transport):
+    """Обмен через stdin/stdout без текстового декодирования и print()"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+
+    def read(self) -> bytes:
+        frame = self.stdin.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        # один вызов write на кадр и явный flush, иначе ответ может застрять в буфере
+        self.stdout.write(frame + b'\n')
+        self.stdout.flush()
+
+
+class SocketTransport(Transport):
+    """Обмен через Unix-сокет (например, с локальным рефери)"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+
+    def read(self) -> bytes:
+        frame = self.stream.readline()
+        if not frame:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.sock.sendall(frame + b'\n')
+
+
+class QueueTransport(Transport):
+    """Обмен через очереди внутри одного процесса, None во входной очереди завершает игру"""
+
+    def __init__(self, inbox: Queue = None, outbox: Queue = None):
+        self.inbox = inbox or Queue()
+        self.outbox = outbox or Queue()
+
+    def read(self) -> bytes:
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return frame
+
+    def write(self, frame: bytes) -> None:
+        self.outbox.put(frame)
 
-        x1, y1, z1 = point1.coords
-        x2, y2, z2 = point2.coords
-
-        points = [(x1, y1, z1)]
-        x_shift = abs(x2 - x1)
-        y_shift = abs(y2 - y1)
-        z_shift = abs(z2 - z1)
-
-        x_step = int(x2 > x1)
-        y_step = int(y2 > y1)
-        z_step = int(z2 > z1)
-
-        # изменения поведения в зависимости от ведущей оси
-        if x_shift >= y_shift and x_shift >= z_shift:
-            # p1, p2 - смещение относительно ведущей оси, не стал изменять названия переменных
-            p1 = 2 * y_shift - x_shift
-            p2 = 2 * z_shift - x_shift
-            while x1 != x2:
-                x1 += x_step
-                if p1 >= 0:
-                    y1 += y_step
-                    p1 -= 2 * x_shift
-                if p2 >= 0:
-                    z1 += z_step
-                    p2 -= 2 * x_shift
-                p1 += 2 * y_shift
-                p2 += 2 * z_shift
-                points.append(Vector(x1, y1, z1))
-        elif y_shift >= x_shift and y_shift >= z_shift:
-            p1 = 2 * x_shift - y_shift
-            p2 = 2 * z_shift - y_shift
-            while y1 != y2:
-                y1 += y_step
-                if p1 >= 0:
-                    x1 += x_step
-                    p1 -= 2 * y_shift
-                if p2 >= 0:
-                    z1 += z_step
-                    p2 -= 2 * y_shift
-                p1 += 2 * x_shift
-                p2 += 2 * z_shift
-                points.append(Vector(x1, y1, z1))
+
+# endregion
+
+
+# region Profiling
+
+
+class Profiler:
+    """
+    Время фаз хода: `start` в начале хода, `lap(phase)` после каждой фазы записывает время с прошлой отметки.
+    Стратегия может ставить свои отметки внутри battle (выбор целей, движение, команды),
+    тогда в фазу battle попадает только остаток после последней из них.
+    Включается переменной окружения PROFILE=stderr или PROFILE=путь_к_файлу, выключенный ничего не замеряет
+    """
+    # корзины гистограммы по степеням двойки микросекунд: последняя собирает всё дольше ~8 секунд
+    BUCKETS = 24
+
+    def __init__(self, target: str = None):
+        self.target = target
+        self.enabled = bool(target)
+        self.phases = {}
+        self.last = 0.0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        # [число замеров, сумма, максимум, гистограмма]
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * self.BUCKETS]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3][min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    @staticmethod
+    def quantile(histogram: List[int], count: int, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль `q`, в миллисекундах"""
+        seen = 0
+        for bucket, hits in enumerate(histogram):
+            seen += hits
+            if seen >= q * count:
+                return (1 << bucket) / 1000
+        return float('inf')
+
+    def report(self) -> str:
+        lines = [f'{"phase":<12} {"count":>6} {"mean, ms":>9} {"p50 <=":>8} {"p99 <=":>8} {"max, ms":>9}']
+        for phase, (count, total, worst, histogram) in self.phases.items():
+            lines.append(f'{phase:<12} {count:>6} {total / count * 1000:>9.3f} '
+                         f'{min(self.quantile(histogram, count, 0.5), worst * 1000):>8.3f} '
+                         f'{min(self.quantile(histogram, count, 0.99), worst * 1000):>8.3f} '
+                         f'{worst * 1000:>9.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self) -> None:
+        """Сводка в stderr или в файл в конце игры; stdout занят протоколом"""
+        if not self.enabled or not self.phases:
+            return
+        if self.target == 'stderr':
+            sys.stderr.write(self.report())
+            sys.stderr.flush()
         else:
-            p1 = 2 * y_shift - z_shift
-            p2 = 2 * x_shift - z_shift
-            while z1 != z2:
-                z1 += z_step
-                if p1 >= 0:
-                    y1 += y_step
-                    p1 -= 2 * z_shift
-                if p2 >= 0:
-                    x1 += x_step
-                    p2 -= 2 * z_shift
-                p1 += 2 * y_shift
-                p2 += 2 * x_shift
-                points.append(Vector(x1, y1, z1))
-
-        return points[:length or 999]  # не самый лучший вариант, зато в коде места не занимает
+            with open(self.target, 'a') as file:
+                file.write(self.report())
+
+
+PROFILER = Profiler(os.environ.get('PROFILE'))
 
 
 # endregion
@@ -191,20 +729,7 @@ class Block(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        if BlockType(data['Type']) == BlockType.Energy:
-            return EnergyBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Gun:
-            return GunBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Engine:
-            return EngineBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Health:
-            return HealthBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Shield:
-            return ShieldBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Radar:
-            return RadarBlock(**data)
-        elif BlockType(data['Type']) == BlockType.Heal:
-            return HealBlock(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -273,7 +798,7 @@ class DraftCompleteShip(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -283,8 +808,7 @@ class DraftEquipment(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        data['Equipment'] = Block.from_json(data['Equipment'])
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -294,9 +818,7 @@ class MapRegion(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        data['From'] = Vector.from_json(data['From'])
-        data['To'] = Vector.from_json(data['To'])
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -311,12 +833,19 @@ class DraftOptions(JSONCapability):
     DraftTimeout: int = None
     BattleRoundTimeout: int = None
 
+    def max_radius(self) -> int:
+        """Наибольший радиус среди пушек и ремонтных блоков каталога"""
+        return max([item.Equipment.Radius for item in self.Equipment
+                    if isinstance(item.Equipment, (GunBlock, HealBlock))], default=0)
+
+    def max_accelerate(self) -> int:
+        """Наибольшее ускорение среди двигателей каталога, оценка для кораблей со скрытым снаряжением"""
+        return max([item.Equipment.MaxAccelerate for item in self.Equipment
+                    if isinstance(item.Equipment, EngineBlock)], default=0)
+
     @classmethod
     def from_json(cls, data):
-        data['StartArea'] = MapRegion.from_json(data['StartArea'])
-        data['Equipment'] = list(map(DraftEquipment.from_json, data['Equipment']))
-        data['CompleteShips'] = list(map(DraftCompleteShip.from_json, data['CompleteShips']))
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 # endregion
@@ -354,11 +883,7 @@ class Ship(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        if data.get('Equipment'):  # не доступно для оппонента
-            data['Equipment'] = list(map(Block.from_json, data.get('Equipment', [])))
-        data['Position'] = Vector.from_json(data['Position'])
-        data['Velocity'] = Vector.from_json(data['Velocity'])
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -369,9 +894,7 @@ class FireInfo(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        data['Source'] = Vector.from_json(data['Source'])
-        data['Target'] = Vector.from_json(data['Target'])
-        return cls(**data)
+        return DECODERS[cls](data)
 
 
 @dataclass
@@ -382,10 +905,186 @@ class State(JSONCapability):
 
     @classmethod
     def from_json(cls, data):
-        data['My'] = list(map(Ship.from_json, data['My']))
-        data['Opponent'] = list(map(Ship.from_json, data['Opponent']))
-        data['FireInfos'] = list(map(FireInfo.from_json, data['FireInfos']))
-        return cls(**data)
+        return DECODERS[cls](data)
+
+
+# endregion
+
+
+# region Turn Diff
+
+
+@dataclass
+class FleetDiff:
+    """
+    Изменения одной стороны между соседними ходами по Id кораблей:
+    сдвинувшиеся, уничтоженные, появившиеся, а для изменившихся здоровья и энергии - на сколько
+    """
+    Moved: List[int]
+    Destroyed: List[int]
+    Appeared: List[int]
+    Health: Dict[int, int]
+    Energy: Dict[int, int]
+
+    def __bool__(self):
+        return bool(self.Moved or self.Destroyed or self.Appeared or self.Health or self.Energy)
+
+    @property
+    def changed(self) -> set:
+        """Id кораблей, у которых изменилось хоть что-то (включая уничтоженные и новые)"""
+        return {*self.Moved, *self.Destroyed, *self.Appeared, *self.Health, *self.Energy}
+
+    @classmethod
+    def between(cls, previous: List[Ship], current: List[Ship]):
+        before = {ship.Id: ship for ship in previous}
+        moved, appeared, health, energy = [], [], {}, {}
+        for ship in current:
+            old = before.pop(ship.Id, None)
+            if old is None:
+                appeared.append(ship.Id)
+                continue
+            if old.Position != ship.Position:
+                moved.append(ship.Id)
+            if old.Health != ship.Health:
+                health[ship.Id] = (ship.Health or 0) - (old.Health or 0)
+            if old.Energy != ship.Energy:
+                energy[ship.Id] = (ship.Energy or 0) - (old.Energy or 0)
+        return cls(Moved=moved, Destroyed=list(before), Appeared=appeared, Health=health, Energy=energy)
+
+
+@dataclass
+class StateDiff:
+    """
+    Разность разобранных соседних ходов. `FireInfos` - все выстрелы этого хода, а не разность с прошлым:
+    сервер каждый ход присылает только новые выстрелы, и повторный выстрел в ту же клетку - тоже новый
+    """
+    My: FleetDiff
+    Opponent: FleetDiff
+    FireInfos: List[FireInfo]
+
+    def __bool__(self):
+        return bool(self.My or self.Opponent or self.FireInfos)
+
+    @classmethod
+    def between(cls, previous: State, current: State):
+        """Для первого хода (`previous` - None) все корабли считаются появившимися"""
+        if previous is None:
+            previous = State(My=[], Opponent=[], FireInfos=[])
+
+        return cls(My=FleetDiff.between(previous.My, current.My),
+                   Opponent=FleetDiff.between(previous.Opponent, current.Opponent),
+                   FireInfos=list(current.FireInfos))
+
+
+# endregion
+
+
+# region Fleet Arrays
+
+
+def parse_vectors(values: List[str]) -> np.ndarray:
+    """Строки 'x/y/z' сразу в массив (N, 3) без промежуточных Vector"""
+    return np.fromstring(' '.join(values).replace('/', ' '), dtype=np.int64, sep=' ').reshape(-1, 3)
+
+
+@dataclass
+class FleetArrays:
+    """
+    Флот в виде столбцов (struct of arrays): i-я строка каждого массива относится к i-му кораблю.
+    У кораблей без пушек (и у оппонента, чьё снаряжение скрыто) радиус и урон равны нулю
+    """
+    Id: np.ndarray
+    Position: np.ndarray
+    Velocity: np.ndarray
+    Health: np.ndarray
+    Energy: np.ndarray
+    GunRadius: np.ndarray
+    GunDamage: np.ndarray
+
+    def __len__(self):
+        return len(self.Id)
+
+    @classmethod
+    def from_json(cls, data: List[dict]):
+        gun_type = BlockType.Gun.value
+        gun_radius, gun_damage = [], []
+        for ship in data:
+            radius = damage = 0
+            for block in ship.get('Equipment') or ():
+                if block['Type'] == gun_type:
+                    radius = max(radius, block['Radius'])
+                    damage += block['Damage']
+            gun_radius.append(radius)
+            gun_damage.append(damage)
+
+        return cls(Id=np.array([ship['Id'] for ship in data], dtype=np.int64),
+                   Position=parse_vectors([ship['Position'] for ship in data]),
+                   Velocity=parse_vectors([ship['Velocity'] for ship in data]),
+                   Health=np.array([ship.get('Health') or 0 for ship in data], dtype=np.int64),
+                   Energy=np.array([ship.get('Energy') or 0 for ship in data], dtype=np.int64),
+                   GunRadius=np.array(gun_radius, dtype=np.int64),
+                   GunDamage=np.array(gun_damage, dtype=np.int64))
+
+
+@dataclass
+class StateArrays:
+    """Векторное представление хода, строится из того же словаря, что и `State`"""
+    My: FleetArrays
+    Opponent: FleetArrays
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(My=FleetArrays.from_json(data['My']),
+                   Opponent=FleetArrays.from_json(data['Opponent']))
+
+
+class Trajectories:
+    """
+    Прогноз положений кораблей на 0..horizon ходов вперёд при неизменной скорости, сразу для всех кораблей.
+    Упёршись в стену, корабль по этой оси останавливается, поэтому положение через t ходов -
+    просто `Position + t * Velocity`, обрезанное по границам карты.
+    `spread[t, i]` - на сколько клеток по каждой оси i-й корабль может уйти от прогноза за t ходов,
+    если будет ускоряться: a + 2a + ... + ta при его наибольшем ускорении a
+    """
+
+    def __init__(self, positions, velocities, map_size: int, accelerate, horizon: int = 8):
+        self.base = Physics.as_points(positions)
+        self.velocity = Physics.as_points(velocities)
+        self.high = map_size - 1
+        self.accelerate = np.broadcast_to(np.asarray(accelerate, dtype=np.int64), len(self.base))
+        self.extend(horizon)
+
+    def extend(self, horizon: int) -> None:
+        turns = np.arange(horizon + 1)
+        self.positions = np.clip(self.base[None, :, :] + turns[:, None, None] * self.velocity[None, :, :],
+                                 0, self.high)
+        self.spread = (turns * (turns + 1) // 2)[:, None] * self.accelerate[None, :]
+
+    @classmethod
+    def of(cls, ships: List[Ship], map_size: int, accelerate: int = 0, horizon: int = 8):
+        """
+        Прогноз для списка кораблей; ускорение берётся из их двигателей,
+        а для кораблей со скрытым снаряжением (оппонент) - `accelerate`
+        """
+        accelerations = []
+        for ship in ships:
+            if ship.Equipment is None:
+                accelerations.append(accelerate)
+            else:
+                accelerations.append(sum(block.MaxAccelerate for block in ship.Equipment
+                                         if isinstance(block, EngineBlock)))
+        return cls([ship.Position for ship in ships], [ship.Velocity for ship in ships],
+                   map_size, accelerations, horizon)
+
+    def at(self, turns: int) -> np.ndarray:
+        """Положения (N, 3) через `turns` ходов"""
+        if turns >= len(self.positions):
+            self.extend(max(turns, 2 * (len(self.positions) - 1)))
+        return self.positions[turns]
+
+    def lead(self, index: int, turns: int = 1) -> Vector:
+        """Куда целиться в `index`-й корабль: урон считается по положениям после хода, то есть через один ход"""
+        return Vector(*self.at(turns)[index].tolist())
 
 
 # endregion
@@ -452,41 +1151,444 @@ class UserOutput(JSONCapability):
 # endregion
 
 
+# region Decoders
+
+
+def compile_decoder(cls, converters: Dict[str, Callable] = None, lists: Dict[str, Callable] = None) -> Callable:
+    """
+    Генерирует функцию разбора словаря в dataclass `cls`:
+    поля читаются напрямую и передаются в конструктор позиционно, входной словарь не изменяется.
+    `converters` - преобразования отдельных значений, `lists` - преобразования элементов списков
+    """
+    converters = converters or {}
+    lists = lists or {}
+    namespace = {'cls': cls}
+    body, args = [], []
+
+    for i, field in enumerate(fields(cls)):
+        name = field.name
+        if field.default is MISSING:
+            value = f'data[{name!r}]'
+        else:
+            namespace[f'default_{i}'] = field.default
+            value = f'data.get({name!r}, default_{i})'
+
+        if name in converters:
+            namespace[f'convert_{i}'] = converters[name]
+            expression = f'convert_{i}(value_{i})'
+        elif name in lists:
+            namespace[f'convert_{i}'] = lists[name]
+            expression = f'[convert_{i}(item) for item in value_{i}]'
+        else:
+            args.append(value)
+            continue
+
+        if field.default is MISSING:
+            args.append(expression.replace(f'value_{i}', value))
+        else:
+            # необязательные поля могут отсутствовать (например, снаряжение оппонента)
+            body.append(f'    value_{i} = {value}')
+            body.append(f'    if value_{i} is not None:')
+            body.append(f'        value_{i} = {expression}')
+            args.append(f'value_{i}')
+
+    function_name = f'decode_{cls.__name__}'
+    source = '\n'.join([f'def {function_name}(data):', *body, f'    return cls({", ".join(args)})'])
+    exec(source, namespace)
+    return namespace[function_name]
+
+
+BLOCK_CLASSES = {
+    BlockType.Energy.value: EnergyBlock,
+    BlockType.Gun.value: GunBlock,
+    BlockType.Engine.value: EngineBlock,
+    BlockType.Health.value: HealthBlock,
+    BlockType.Shield.value: ShieldBlock,
+    BlockType.Radar.value: RadarBlock,
+    BlockType.Heal.value: HealBlock,
+}
+
+DECODERS = {block_class: compile_decoder(block_class) for block_class in BLOCK_CLASSES.values()}
+BLOCK_DECODERS = {block_type: DECODERS[block_class] for block_type, block_class in BLOCK_CLASSES.items()}
+
+
+def decode_block(data: dict) -> Block:
+    """Выбор класса блока по таблице вместо цепочки сравнений BlockType"""
+    return BLOCK_DECODERS[data['Type']](data)
+
+
+DECODERS[Block] = decode_block
+DECODERS[DraftCompleteShip] = compile_decoder(DraftCompleteShip)
+DECODERS[DraftEquipment] = compile_decoder(DraftEquipment, converters={'Equipment': decode_block})
+DECODERS[MapRegion] = compile_decoder(MapRegion, converters={'From': Vector.from_json, 'To': Vector.from_json})
+DECODERS[DraftOptions] = compile_decoder(DraftOptions,
+                                         converters={'StartArea': DECODERS[MapRegion]},
+                                         lists={'Equipment': DECODERS[DraftEquipment],
+                                                'CompleteShips': DECODERS[DraftCompleteShip]})
+DECODERS[Ship] = compile_decoder(Ship,
+                                 converters={'Position': Vector.from_json, 'Velocity': Vector.from_json},
+                                 lists={'Equipment': decode_block})
+DECODERS[FireInfo] = compile_decoder(FireInfo, converters={'Source': Vector.from_json, 'Target': Vector.from_json})
+DECODERS[State] = compile_decoder(State, lists={'My': DECODERS[Ship],
+                                                'Opponent': DECODERS[Ship],
+                                                'FireInfos': DECODERS[FireInfo]})
+
+
+# endregion
+
+
+# region Encoders
+
+
+def encode_value(value) -> str:
+    """JSON-представление значения: через скомпилированный кодировщик, если форма объекта известна"""
+    encoder = ENCODERS.get(type(value))
+    if encoder is None:
+        return json.dumps(value, default=JSONCapability.to_json, ensure_ascii=False)
+    return encoder(value)
+
+
+def encode_list(values: list) -> str:
+    return '[' + ', '.join([encode_value(value) for value in values]) + ']'
+
+
+def compile_encoder(cls) -> Callable:
+    """
+    Генерирует функцию сериализации объекта `cls` в JSON-строку по шаблону полей.
+    Результат совпадает с `json.dumps(obj, default=JSONCapability.to_json, ensure_ascii=False)`:
+    поля со значением None пропускаются, векторы записываются строкой. Шаблон поля применяется, только если
+    тип значения в точности объявленный, иначе (True в int, число в str, массив вместо Vector) - `encode_value`
+    """
+    namespace = {'quote': encode_basestring, 'encode_value': encode_value, 'encode_list': encode_list,
+                 'Vector': Vector}
+    loads, checks, items = [], [], []
+
+    for i, field in enumerate(fields(cls)):
+        kind = None
+        if field.type is Vector:
+            item, kind = f'"{{value_{i}}}"', 'Vector'
+        elif field.type is int:
+            item, kind = f'{{value_{i}}}', 'int'
+        elif field.type is str:
+            item, kind = f'{{quote(value_{i})}}', 'str'
+        elif getattr(field.type, '__origin__', None) is list:
+            item, kind = f'{{encode_list(value_{i})}}', 'list'
+        else:
+            item = f'{{encode_value(value_{i})}}'
+        loads.append(f'    value_{i} = obj.{field.name}')
+        checks.append(f'value_{i} is not None' if kind is None else f'type(value_{i}) is {kind}')
+        items.append((f'value_{i}', kind, f'"{field.name}": {item}', f'"{field.name}": {{encode_value(value_{i})}}'))
+
+    function_name = f'encode_{cls.__name__}'
+    source = [f'def {function_name}(obj):', *loads]
+    if items:
+        # обычно все поля заполнены значениями объявленных типов - тогда хватает одной f-строки
+        source.append(f'    if {" and ".join(checks)}:')
+        source.append(f'        return f\'{{{{{", ".join(item for _, _, item, _ in items)}}}}}\'')
+    source.append('    parts = []')
+    for value, kind, item, fallback in items:
+        source.append(f'    if {value} is not None:')
+        if kind is None:
+            source.append(f'        parts.append(f\'{item}\')')
+        else:
+            source.append(f'        parts.append(f\'{item}\' if type({value}) is {kind} else f\'{fallback}\')')
+    source.append('    return \'{\' + \', \'.join(parts) + \'}\'')
+
+    exec('\n'.join(source), namespace)
+    return namespace[function_name]
+
+
+def encode(result) -> bytes:
+    """Готовый к отправке кадр ответа"""
+    return encode_value(result).encode()
+
+
+ENCODERS = {cls: compile_encoder(cls) for cls in [CommandParameters, MoveParameters, AccelerateParameters,
+                                                  AttackParameters, DefendParameters, ScanParameters,
+                                                  Command, UserOutput, DraftShipChoice, DraftChoice]}
+ENCODERS[Vector] = lambda vector: f'"{vector}"'  # иначе json.dumps запишет кортеж списком
+
+
+# endregion
+
+
+# region Planning
+
+
+class Deadline:
+    """Момент (по time.perf_counter), к которому ответ хода должен быть готов"""
+
+    def __init__(self, budget: float, started: float = None):
+        self.started = time.perf_counter() if started is None else started
+        self.at = self.started + budget
+
+    def remaining(self) -> float:
+        return self.at - time.perf_counter()
+
+    def expired(self) -> bool:
+        return time.perf_counter() >= self.at
+
+    def allows(self, seconds: float) -> bool:
+        """Успеет ли завершиться работа, которая займёт `seconds` секунд"""
+        return time.perf_counter() + seconds < self.at
+
+
+class RoundTimer:
+    """
+    Бюджет хода: доля таймаута из DraftOptions минус время сериализации и отправки ответа,
+    которое оценивается по прошлым ходам
+    """
+    SAFETY = 0.8
+
+    def __init__(self):
+        self.overhead = 0.0
+
+    def deadline(self, started: float, timeout: int = None) -> Deadline:
+        """Дедлайн для хода, ввод которого прочитан в момент `started`; `timeout` в миллисекундах"""
+        if not timeout:
+            return Deadline(float('inf'), started)
+        return Deadline(timeout / 1000 * self.SAFETY - self.overhead, started)
+
+    def measure(self, seconds: float) -> None:
+        self.overhead = 0.7 * self.overhead + 0.3 * seconds if self.overhead else seconds
+
+
+class Planner:
+    """
+    Anytime-планирование: этапы выполняются от дешёвого к дорогому, пока позволяет дедлайн,
+    и каждый предлагает ответ через `offer`. Лучший найденный ответ всегда готов к отправке.
+    Этап - функция `stage(planner, *args)`, в долгих циклах она сама проверяет `planner.deadline`
+    """
+    # средняя длительность этапов по прошлым ходам, чтобы не начинать этап, который не успеет завершиться
+    estimates = {}
+
+    def __init__(self, deadline: Deadline = None):
+        self.deadline = deadline or Deadline(float('inf'))
+        self.best = None
+        self.score = float('-inf')
+
+    def offer(self, answer, score: float = 0.0) -> bool:
+        """Запоминает ответ, если он не хуже лучшего найденного"""
+        if score < self.score:
+            return False
+        self.best, self.score = answer, score
+        return True
+
+    def run(self, stages: List[Callable], *args):
+        for stage in stages:
+            key = getattr(stage, '__qualname__', repr(stage))
+            # первый этап выполняется всегда, иначе отвечать будет нечем
+            if self.best is not None and not self.deadline.allows(self.estimates.get(key, 0.0)):
+                break
+
+            started = time.perf_counter()
+            stage(self, *args)
+            elapsed = time.perf_counter() - started
+            self.estimates[key] = 0.7 * self.estimates[key] + 0.3 * elapsed if key in self.estimates else elapsed
+        return self.best
+
+
+# endregion
+
+
+# region Recording
+
+
+def diff_ships(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Разность списков кораблей по Id: для изменившихся кораблей только изменившиеся поля,
+    None - корабль уничтожен, полный словарь (с Id) - новый корабль
+    """
+    before = {ship['Id']: ship for ship in previous}
+    delta = {}
+    for ship in current:
+        old = before.pop(ship['Id'], None)
+        if old is None:
+            delta[str(ship['Id'])] = ship
+            continue
+        changes = {key: value for key, value in ship.items() if old.get(key) != value}
+        changes.update((key, None) for key in old if key not in ship)
+        if changes:
+            delta[str(ship['Id'])] = changes
+    delta.update((str(ship_id), None) for ship_id in before)
+    return delta
+
+
+def apply_ships(previous: List[dict], delta: dict) -> List[dict]:
+    """Обратная к `diff_ships` операция"""
+    ships = []
+    for ship in previous:
+        key = str(ship['Id'])
+        if key not in delta:
+            ships.append(ship)
+        elif delta[key] is not None:
+            merged = {**ship, **delta[key]}
+            ships.append({field: value for field, value in merged.items() if value is not None})
+    ships.extend(ship for ship in delta.values() if ship is not None and 'Id' in ship)
+    return ships
+
+
+def diff_state(previous: dict, current: dict) -> dict:
+    """Разность соседних ходов: корабли сторон через `diff_ships`, остальные поля - целиком, если изменились"""
+    delta = {}
+    for key, value in current.items():
+        if key in ('My', 'Opponent'):
+            ships = diff_ships(previous.get(key, []), value)
+            if ships:
+                delta[key] = ships
+            # порядок кораблей сохраняется только если его нельзя восстановить
+            order = [ship['Id'] for ship in value]
+            if order != [ship['Id'] for ship in apply_ships(previous.get(key, []), ships)]:
+                delta[key + 'Order'] = order
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def apply_state(previous: dict, delta: dict) -> dict:
+    """Обратная к `diff_state` операция"""
+    state = {**previous, **{key: value for key, value in delta.items() if key not in ('My', 'Opponent')}}
+    for key in 'My', 'Opponent':
+        ships = apply_ships(previous.get(key, []), delta.get(key, {}))
+        if key + 'Order' in delta:
+            by_id = {ship['Id']: ship for ship in ships}
+            ships = [by_id[ship_id] for ship_id in state.pop(key + 'Order')]
+        state[key] = ships
+    return state
+
+
+class Recorder:
+    """
+    Запись матча в gzip-файл, по строке на событие: `D` - ввод драфта, `S` - первое состояние боя,
+    `d` - разность с предыдущим состоянием (`diff_state`), `O` - отправленный ответ как есть
+    """
+
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wb')
+        self.previous = None
+
+    def record(self, data: dict, frame: bytes, answer: bytes) -> None:
+        if 'PlayerId' in data:
+            self.file.write(b'D\t' + frame.rstrip(b'\n') + b'\n')
+        elif self.previous is None:
+            self.file.write(b'S\t' + frame.rstrip(b'\n') + b'\n')
+        else:
+            delta = json.dumps(diff_state(self.previous, data), ensure_ascii=False, separators=(',', ':'))
+            self.file.write(b'd\t' + delta.encode() + b'\n')
+        if 'PlayerId' not in data:
+            self.previous = data
+        self.file.write(b'O\t' + answer + b'\n')
+        # сброс после каждого хода, чтобы запись читалась, даже если процесс бота убьют
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[str, dict]]:
+    """События записи (`Recorder`) с восстановленными полными состояниями: ('draft' | 'battle' | 'output', данные)"""
+    state = None
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                tag, payload = line.rstrip(b'\n').split(b'\t', 1)
+                data = json.loads(payload)
+                if tag == b'D':
+                    yield 'draft', data
+                elif tag == b'O':
+                    yield 'output', data
+                else:
+                    state = data if tag == b'S' else apply_state(state, data)
+                    yield 'battle', state
+        except EOFError:
+            # запись оборвана вместе с процессом бота
+            return
+
+
+# endregion
+
+
 class Game:
     def __init__(self):
         self.draft_options = None
+        self.state = None
+        self.trajectories = None
 
-    def draft(self, data: dict) -> DraftChoice:
+    def draft(self, data: dict, deadline: Deadline = None) -> DraftChoice:
         self.draft_options = DraftOptions.from_json(data)
+        VECTORS.resize(self.draft_options.MapSize)
+        GEOMETRY.prepare(self.draft_options.max_radius())
         draft_choice = DraftChoice()
 
         # тут должно быть поведение во время драфта
 
         return draft_choice
 
-    def battle(self, data: dict) -> UserOutput:
+    def battle(self, data: dict, deadline: Deadline = None) -> UserOutput:
         state = State.from_json(data)
-        user_output = UserOutput()
-
-        # тут должно быть поведение во время боя
-
-        return user_output
-
-    def main(self):
+        diff = self.observe(state)
+        PROFILER.lap('state')
+        planner = Planner(deadline)
+        planner.offer(UserOutput())
+
+        # тут должно быть поведение во время боя: этапы от дешёвого к дорогому,
+        # например planner.run([self.greedy, self.search], state);
+        # diff подскажет, что пересчитать с прошлого хода, а
+        # PROFILER.lap('targets') после выбора целей и т.п. разобьёт время хода на фазы
+
+        return planner.best
+
+    def observe(self, state: State) -> StateDiff:
+        """Запоминает ход и возвращает его отличия от прошлого, чтобы кэши пересчитывались только для изменившегося"""
+        diff = StateDiff.between(self.state, state)
+        self.state = state
+        self.trajectories = None
+        return diff
+
+    def predict(self, turns: int = 1) -> np.ndarray:
+        """Положения кораблей оппонента (в порядке state.Opponent) через `turns` ходов; прогноз строится раз за ход"""
+        if self.trajectories is None:
+            self.trajectories = Trajectories.of(self.state.Opponent, self.draft_options.MapSize,
+                                                self.draft_options.max_accelerate())
+        return self.trajectories.at(turns)
+
+    def main(self, transport: Transport = None, recorder: Recorder = None):
+        transport = transport or StdioTransport()
+        timer = RoundTimer()
         while True:
-            line_in = input()
-            data = json.loads(line_in)
+            try:
+                frame = transport.read()
+            except EOFError:
+                break
+            started = time.perf_counter()
+            PROFILER.start()
+            data = json.loads(frame)
+            PROFILER.lap('decode')
 
             if 'PlayerId' in data:
-                result = self.draft(data)
+                result = self.draft(data, timer.deadline(started, data.get('DraftTimeout')))
+                PROFILER.lap('draft')
             else:
-                result = self.battle(data)
+                timeout = self.draft_options and self.draft_options.BattleRoundTimeout
+                result = self.battle(data, timer.deadline(started, timeout))
+                PROFILER.lap('battle')
+
+            finished = time.perf_counter()
+            answer = encode(result)
+            PROFILER.lap('encode')
+            transport.write(answer)
+            PROFILER.lap('write')
+            timer.measure(time.perf_counter() - finished)
+
+            if recorder is not None:
+                recorder.record(data, frame, answer)
+                PROFILER.lap('record')
 
-            line_out = json.dumps(result,
-                                  default=JSONCapability.to_json,
-                                  ensure_ascii=False)
-            print(line_out)
+        if recorder is not None:
+            recorder.close()
+        PROFILER.dump()
 
 
 if __name__ == '__main__':
-    Game().main()
+    # python sample.py match.rec.gz - записать матч для replay.py
+    Game().main(recorder=Recorder(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,49 @@
+"""
+Сгенерированные декодеры и кодировщики должны давать то же, что и разбор и `json.dumps` по старому шаблону
+Запуск: python -m pytest tests
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from bench import reference_encode, reference_state, synthetic_output, synthetic_state
+from sample import (ATTACK, MOVE, AttackParameters, Command, DraftChoice, DraftShipChoice, MoveParameters, State,
+                    UserOutput, Vector, encode)
+
+
+@pytest.mark.parametrize('ships', [0, 1, 5, 50])
+def test_decode_matches_reference(ships):
+    line = json.dumps(synthetic_state(ships, seed=ships))
+    assert State.from_json(json.loads(line)) == reference_state(json.loads(line))
+
+
+@pytest.mark.parametrize('ships', [1, 5, 50])
+def test_encode_round_trip(ships):
+    user_output = synthetic_output(State.from_json(synthetic_state(ships, seed=ships)))
+    frame = encode(user_output)
+    assert frame == reference_encode(user_output)
+    assert json.loads(frame) == json.loads(reference_encode(user_output))
+
+
+@pytest.mark.parametrize('result', [
+    UserOutput(UserCommands=[], Message='привет, "мир"\n'),
+    UserOutput(UserCommands=None, Message=None),
+    DraftChoice(Ships=[DraftShipChoice(CompleteShipId='forward', Position=None)]),
+    # значения не того типа, что объявлен в поле, записываются так же, как их записал бы json.dumps
+    UserOutput(UserCommands=[Command(Command=MOVE, Parameters=MoveParameters(Id=True, Target=Vector(1, 2, 3)))],
+               Message=5),
+    Command(Command=ATTACK, Parameters=AttackParameters(Id=7, Name='blaster', Target=None)),
+    DraftChoice(Ships=(DraftShipChoice(CompleteShipId='forward', Position=Vector(0, 0, 0)),), Message='x'),
+])
+def test_encode_matches_reference(result):
+    assert encode(result) == reference_encode(result)
+
+
+def test_encode_fails_like_reference():
+    result = MoveParameters(Id=1, Target=np.array([1, 2, 3]))
+    with pytest.raises(Exception) as expected:
+        reference_encode(result)
+    with pytest.raises(expected.type):
+        encode(result)
@@ -0,0 +1,198 @@
+"""
+Круговой турнир стратегий: каждая пара играет на нескольких seed'ах с обеих сторон,
+боты запускаются отдельными процессами и общаются с движком через stdin/stdout, как с сервером
+Запуск: python tournament.py [algos/final.py algos/simple.py ...] [--seeds 10] [--workers 8]
+"""
+
+import argparse
+import ast
+import glob
+import json
+import os
+import selectors
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import permutations
+from typing import List
+
+import numpy as np
+
+from engine import Engine
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class BotError(Exception):
+    """Бот завершился, не ответил вовремя или ответил не по протоколу"""
+
+    def __init__(self, *players: int):
+        super().__init__(*players)
+        self.players = players
+
+
+class BotProcess:
+    """Стратегия в отдельном процессе: один кадр JSON на строку в каждую сторону"""
+    # запуск интерпретатора и импорты не входят в таймаут драфта сервера, поэтому на первый ответ даётся запас, с
+    STARTUP = 10.0
+
+    def __init__(self, path: str, player: int):
+        self.player = player
+        self.process = subprocess.Popen([sys.executable, path], cwd=ROOT, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.buffer = b''
+
+    def ask(self, data: dict, timeout: float = None):
+        """
+        Ответ бота и время от отправки ввода до получения ответа.
+        Если строка ответа не пришла за `timeout` секунд, бот считается зависшим
+        """
+        frame = json.dumps(data, ensure_ascii=False).encode() + b'\n'
+        started = time.perf_counter()
+        try:
+            self.process.stdin.write(frame)
+            self.process.stdin.flush()
+            # readline блокировал бы навсегда, поэтому ответ дочитывается кусками с ожиданием через selector
+            while b'\n' not in self.buffer:
+                remaining = None if timeout is None else started + timeout - time.perf_counter()
+                if remaining is not None and remaining <= 0 or not self.selector.select(remaining):
+                    raise BotError(self.player)
+                chunk = os.read(self.process.stdout.fileno(), 1 << 16)
+                if not chunk:
+                    raise BotError(self.player)
+                self.buffer += chunk
+            answer, _, self.buffer = self.buffer.partition(b'\n')
+            elapsed = time.perf_counter() - started
+            return json.loads(answer), elapsed
+        except (OSError, ValueError):
+            raise BotError(self.player)
+
+    def close(self, kill: bool = False) -> None:
+        """Завершение по концу ввода; зависший или нарушивший протокол бот (`kill`) снимается сразу"""
+        self.selector.close()
+        if kill:
+            self.process.kill()
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+def check(engine: Engine) -> None:
+    """Неразборчивые команды, записанные движком, засчитываются их авторам"""
+    faulty = [player for player, errors in enumerate(engine.errors) if errors]
+    if faulty:
+        raise BotError(*faulty)
+
+
+def play_match(paths: List[str], seed: int, max_turns: int) -> dict:
+    """
+    Один бой; ошибка бота, превышение таймаута хода или неразборчивый ответ засчитываются поражением его стороны
+    """
+    engine = Engine(seed=seed, max_turns=max_turns)
+    bots = [BotProcess(path, player) for player, path in enumerate(paths)]
+    latencies = [[] for _ in paths]
+    forfeits = []
+    try:
+        options = [engine.draft_options(bot.player) for bot in bots]
+        engine.draft([bot.ask(options[bot.player], BotProcess.STARTUP + options[bot.player]['DraftTimeout'] / 1000)[0]
+                      for bot in bots])
+        check(engine)
+        while not engine.finished:
+            outputs = []
+            for bot in bots:
+                output, elapsed = bot.ask(engine.state(bot.player), options[bot.player]['BattleRoundTimeout'] / 1000)
+                outputs.append(output)
+                latencies[bot.player].append(elapsed)
+            engine.step(outputs)
+            check(engine)
+        winner = engine.winner
+    except BotError as error:
+        # если ошиблись оба, бой прерывается ничьей
+        forfeits = list(error.players)
+        winner = 1 - forfeits[0] if len(forfeits) == 1 else None
+    finally:
+        for bot in bots:
+            bot.close(kill=bot.player in forfeits)
+
+    return {'paths': paths, 'seed': seed, 'winner': winner, 'forfeits': forfeits, 'turns': engine.turn,
+            'latencies': latencies}
+
+
+def discover(pattern: str = 'algos/*.py') -> List[str]:
+    """Файлы стратегий, в которых объявлен класс Game"""
+    paths = []
+    for path in sorted(glob.glob(os.path.join(ROOT, pattern))):
+        with open(path, encoding='utf-8') as file:
+            tree = ast.parse(file.read())
+        if any(isinstance(node, ast.ClassDef) and node.name == 'Game' for node in tree.body):
+            paths.append(os.path.relpath(path, ROOT))
+    return paths
+
+
+def elo(results: List[dict], paths: List[str], k: float = 16.0) -> dict:
+    """Рейтинг Эло по результатам в порядке (seed, пара), чтобы он не зависел от порядка завершения боёв"""
+    rating = {path: 1500.0 for path in paths}
+    for result in sorted(results, key=lambda item: (item['seed'], item['paths'])):
+        first, second = result['paths']
+        expected = 1 / (1 + 10 ** ((rating[second] - rating[first]) / 400))
+        score = 0.5 if result['winner'] is None else float(result['winner'] == 0)
+        rating[first] += k * (score - expected)
+        rating[second] -= k * (score - expected)
+    return rating
+
+
+def report(results: List[dict], paths: List[str]) -> None:
+    rating = elo(results, paths)
+    print(f'{"strategy":<24} {"games":>6} {"win":>5} {"draw":>5} {"loss":>5} {"win %":>6} {"elo":>6} {"forfeit":>7} '
+          f'{"p50, ms":>8} {"p90, ms":>8} {"p99, ms":>8} {"max, ms":>8}')
+    for path in sorted(paths, key=rating.get, reverse=True):
+        games = wins = draws = forfeits = 0
+        latencies = []
+        for result in results:
+            for player, player_path in enumerate(result['paths']):
+                if player_path != path:
+                    continue
+                games += 1
+                wins += result['winner'] == player
+                draws += result['winner'] is None
+                forfeits += player in result['forfeits']
+                latencies.extend(result['latencies'][player])
+
+        p50, p90, p99, worst = np.percentile(latencies, [50, 90, 99, 100]) * 1000 if latencies else [0] * 4
+        print(f'{path:<24} {games:>6} {wins:>5} {draws:>5} {games - wins - draws:>5} '
+              f'{100 * wins / max(games, 1):>6.1f} {rating[path]:>6.0f} {forfeits:>7} '
+              f'{p50:>8.2f} {p90:>8.2f} {p99:>8.2f} {worst:>8.2f}')
+
+
+def tournament(paths: List[str], seeds: int, max_turns: int, workers: int = None) -> List[dict]:
+    """Все упорядоченные пары стратегий на всех seed'ах, бои распределяются по процессам"""
+    matches = [(list(pair), seed) for seed in range(seeds) for pair in permutations(paths, 2)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_match, pair, seed, max_turns) for pair, seed in matches]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--seeds', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    paths = args.paths or discover()
+    started = time.perf_counter()
+    results = tournament(paths, args.seeds, args.turns, args.workers)
+    elapsed = time.perf_counter() - started
+
+    report(results, paths)
+    print(f'{len(results)} matches in {elapsed:.1f} s ({len(results) / elapsed:.2f} matches/s, {args.workers} workers)')